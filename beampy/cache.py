@@ -8,75 +8,545 @@ Manage cache system for slides
 
 import os, sys
 
-try:
-    import cPickle as pkl
-except:
-    #compatibility with python 3.x
-    import pickle as pkl
-
 import gzip
-import copy
+import json
+import time
+import shutil
 import hashlib
 import tempfile
 import glob
+from contextlib import contextmanager
+from functools import wraps
+import threading
 import logging
 _log = logging.getLogger(__name__)
 
+# File locks are only available on posix systems
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class cache_store():
+    """
+    Content addressed storage used by cache_slides.
+
+    The store is a folder containing:
+
+    - index.jsonl: a small append-only index, one json record per
+      line {"k": key, "v": value}. A record with a null value removes
+      the key. The last record of a key wins when the index is read.
+
+    - blobs/ab/abcdef....gz: gzipped payloads named by the sha1 digest
+      of their content and sharded by the two first characters of the
+      digest.
+
+    Index values are dict. Blobs used by an entry are referenced in
+    value['blobs'] = {'name': digest}, this is used by gc() to find
+    orphaned blobs.
+
+    Several processes can share the same store: appends to the index
+    are done under an exclusive lock (on the .lock file) and blobs are
+    written to a temporary file that is atomically renamed.
+    """
+
+    index_name = 'index.jsonl'
+    blobs_name = 'blobs'
+    lock_name = '.lock'
+
+    def __init__(self, folder, shared=False):
+        self.folder = folder
+        self.shared = shared
+        self.index_file = os.path.join(self.folder, self.index_name)
+        self.blobs_folder = os.path.join(self.folder, self.blobs_name)
+        self.lock_file = os.path.join(self.folder, self.lock_name)
+
+        self.index = {}
+        self.pending = []  # Records not yet appended to the index file
+        self.nrecords = 0  # Number of records (lines) in the index file
+        self.orphans = False  # True when set() or remove() dropped a blob reference
+        self.offset = 0  # Position in the index file already read
+        self.inode = None  # Inode of the index file (changed by compact)
+        self.bytes_read = 0  # Size of blobs content read and written
+        self.bytes_written = 0
+
+        if not os.path.isdir(self.folder):
+            try:
+                os.makedirs(self.folder)
+            except OSError:
+                # Created by an other process
+                pass
+
+        with self.lock():
+            self.load_index()
+
+            # Rewrite the index when it contains mostly dead records
+            if self.nrecords > 2 * len(self.index) + 100:
+                self.compact()
+
+    @contextmanager
+    def lock(self):
+        """
+        Exclusive lock on the store (a no-op when fcntl is not available)
+        """
+
+        if fcntl is None:
+            yield
+        else:
+            with open(self.lock_file, 'a') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def load_index(self):
+        """
+        Read the whole index file and replay its records.
+        """
+
+        self.index = {}
+        self.nrecords = 0
+        self.offset = 0
+        self.inode = None
+        self.read_index()
+
+        # Keep the records of this process which are not yet written
+        for record in self.pending:
+            self.apply(record)
+
+    def read_index(self):
+        """
+        Replay the records appended to the index file since the last read.
+        """
+
+        if not os.path.exists(self.index_file):
+            return
+
+        with open(self.index_file, 'rb') as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            f.seek(self.offset)
+            for line in f:
+                # Stop on a line which is still being written
+                if not line.endswith(b'\n'):
+                    break
+
+                self.offset += len(line)
+                self.replay(line.decode('utf-8'))
+
+    def refresh(self):
+        """
+        Load the records written by other processes since the last read.
+        """
+
+        try:
+            stat = os.stat(self.index_file)
+        except OSError:
+            return
+
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            # The index has been compacted (or cleared) by an other process
+            self.load_index()
+        elif stat.st_size > self.offset:
+            self.read_index()
+
+    def replay(self, line):
+        """
+        Apply one line of the index file to self.index
+        """
+
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # Partially written line (interrupted build)
+            _log.debug('Skip broken cache index line: %s' % line)
+            return
+
+        self.nrecords += 1
+        self.apply(record)
+
+    def apply(self, record):
+        if record['v'] is None:
+            self.index.pop(record['k'], None)
+        else:
+            self.index[record['k']] = record['v']
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def get(self, key, default=None):
+        return self.index.get(key, default)
+
+    def set(self, key, value):
+        """
+        Set the value of a key, the record is appended to the index
+        file by the next flush().
+        """
+
+        old = self.index.get(key)
+        if isinstance(old, dict) and 'blobs' in old:
+            if not isinstance(value, dict) or value.get('blobs') != old['blobs']:
+                self.orphans = True
+
+        self.index[key] = value
+        self.pending += [{'k': key, 'v': value}]
+
+    def remove(self, key):
+        if key in self.index:
+            old = self.index.pop(key)
+            if isinstance(old, dict) and 'blobs' in old:
+                self.orphans = True
+
+            self.pending += [{'k': key, 'v': None}]
+
+    def flush(self):
+        """
+        Append pending records to the index file
+        """
+
+        if len(self.pending) > 0:
+            with self.lock():
+                # Read what other processes have written before appending
+                self.refresh()
+                with open(self.index_file, 'ab') as f:
+                    f.write(''.join([json.dumps(r) + '\n' for r in self.pending]).encode('utf-8'))
+                    self.offset = f.tell()
+                    self.inode = os.fstat(f.fileno()).st_ino
+
+            self.nrecords += len(self.pending)
+            self.pending = []
+
+    def compact(self):
+        """
+        Rewrite the index file with only live records (the caller
+        should hold the lock).
+        """
+
+        _log.debug('Compact cache index %s' % self.index_file)
+        fd, tmpname = tempfile.mkstemp(prefix='index_', dir=self.folder)
+        with os.fdopen(fd, 'wb') as f:
+            for key, value in self.index.items():
+                f.write((json.dumps({'k': key, 'v': value}) + '\n').encode('utf-8'))
+
+        os.rename(tmpname, self.index_file)
+        stat = os.stat(self.index_file)
+        self.inode = stat.st_ino
+        self.offset = stat.st_size
+        self.nrecords = len(self.index)
+        self.pending = []
+
+    def blob_path(self, digest):
+        return os.path.join(self.blobs_folder, digest[:2], digest + '.gz')
+
+    def put_blob(self, content):
+        """
+        Store content (str or bytes) and return its digest. Nothing
+        is written when a blob with the same digest already exists.
+        """
+
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+
+        digest = hashlib.sha1(content).hexdigest()
+        fname = self.blob_path(digest)
+        if not os.path.exists(fname):
+            dirname = os.path.dirname(fname)
+            if not os.path.isdir(dirname):
+                try:
+                    os.makedirs(dirname)
+                except OSError:
+                    pass
+
+            # Write to a temporary file and rename it, readers never
+            # see a partial blob
+            fd, tmpname = tempfile.mkstemp(prefix='.tmp_', dir=dirname)
+            with os.fdopen(fd, 'wb') as ftmp:
+                with gzip.GzipFile(fileobj=ftmp, mode='wb') as f:
+                    f.write(content)
+
+            os.rename(tmpname, fname)
+            self.bytes_written += len(content)
+
+        return digest
+
+    def get_blob(self, digest):
+        """
+        Return the content (as bytes) of the blob or None if it does
+        not exist.
+        """
+
+        try:
+            with gzip.open(self.blob_path(digest), 'rb') as f:
+                content = f.read()
+        except IOError:
+            return None
+
+        self.bytes_read += len(content)
+
+        return content
+
+    def has_blob(self, digest):
+        return os.path.exists(self.blob_path(digest))
+
+    def blob_size(self, digest):
+        """
+        Size of the blob file on disk (0 if the blob does not exist)
+        """
+
+        try:
+            return os.path.getsize(self.blob_path(digest))
+        except OSError:
+            return 0
+
+    def referenced_blobs(self):
+        refs = set()
+        for value in self.index.values():
+            if isinstance(value, dict) and 'blobs' in value:
+                refs.update(value['blobs'].values())
+
+        return refs
+
+    def gc(self, min_age=0):
+        """
+        Remove blobs that are not referenced by the index, return the
+        number of removed blobs.
+
+        min_age: int,
+            Only remove blobs older than min_age seconds. Used for
+            shared stores, where an other process may have written a
+            blob without having flushed its index yet.
+        """
+
+        removed = 0
+        tnow = time.time()
+        with self.lock():
+            self.refresh()
+            refs = self.referenced_blobs()
+            for fname in glob.glob(os.path.join(self.blobs_folder, '*', '*.gz')):
+                digest = os.path.basename(fname)[:-3]
+                if digest not in refs:
+                    try:
+                        if tnow - os.path.getmtime(fname) >= min_age:
+                            os.remove(fname)
+                            removed += 1
+                    except OSError:
+                        # Removed by an other process
+                        pass
+
+        self.orphans = False
+        _log.debug('Cache gc removed %i blobs' % removed)
+
+        return removed
+
+    def clear(self):
+        """
+        Remove all entries and blobs
+        """
+
+        with self.lock():
+            self.index = {}
+            self.pending = []
+            self.nrecords = 0
+            self.offset = 0
+            self.inode = None
+            if os.path.exists(self.index_file):
+                os.remove(self.index_file)
+
+            if os.path.isdir(self.blobs_folder):
+                shutil.rmtree(self.blobs_folder)
+
+
+def synchronized(method):
+    """
+    Decorator to run a method of cache_slides with its thread lock
+    (modules could be rendered in threads, see slide.newrender)
+    """
+
+    @wraps(method)
+    def locked_method(self, *args, **kwargs):
+        with self.thread_lock:
+            return method(self, *args, **kwargs)
+
+    return locked_method
+
+
 class cache_slides():
 
-    def __init__(self, cache_dir, document):
+    # Unreferenced blobs of a shared cache are kept during this time
+    # (in seconds) as other processes could be using them
+    shared_gc_min_age = 3600
+
+    # Access time of entries are only written to the index when they
+    # are older than this resolution (in seconds)
+    atime_resolution = 3600
+
+    # Dependencies of latex renders of texts (the preamble is part of their key)
+    text_deps = ['tool:latex', 'tool:dvisvgm']
+
+    # Dependencies of pdf conversions of svg slides (the svg digest is their key)
+    pdf_deps = ['tool:inkscape']
+
+    def __init__(self, cache_dir, document, shared=False, max_size=None,
+                 max_entries=None):
         """
             Create a cache_slides object to store cache in the given cache folder
+
+            When shared is True, cache_dir is a cache root that can be
+            used by several documents (and processes) at the same time.
+
+            max_size and max_entries define the budget of the cache
+            (in bytes of files and number of entries). When the cache
+            exceed them, the least recently used entries are removed.
         """
-        self.folder = cache_dir
+        self.shared = shared
+        self.max_size = max_size
+        self.max_entries = max_entries
+
+        # Lock for modules rendered in threads
+        self.thread_lock = threading.RLock()
+
+        if shared:
+            self.folder = os.path.expanduser(cache_dir)
+        else:
+            self.folder = cache_dir
+
+        # Remove the cache from the old format (one data.pklz file)
+        if os.path.exists(os.path.join(self.folder, 'data.pklz')):
+            print('Remove cache from an old beampy version')
+            for f in glob.glob(os.path.join(self.folder, '*.pklz')):
+                os.remove(f)
+
+        self.store = cache_store(self.folder, shared=shared)
+
+        self.start_build(document)
+
+    def start_build(self, document):
+        """
+        Reset the state of the cache for a new build of the document (a
+        cache_slides could be used for several builds, see beampy watch)
+        """
+
         self.version = document.__version__
         self.global_store = document._global_store
-        self.data = {} #Cache data are stored in a dict
 
-        self.data_file = 'data.pklz'
-        
-        #Try to read cache
-        if os.path.isdir(self.folder):
-            if os.path.exists(self.folder+'/'+self.data_file):
-                with gzip.open(self.folder+'/'+self.data_file, 'rb') as f:
-                    self.data = pkl.load(f)
-                
-        else:
-            os.mkdir(self.folder)
-
-        if 'version' not in self.data or self.data['version'] != self.version:
-            print('Cache file from an other beampy version!')
-            self.data = {}
-            self.remove_files()
-            
-        #check if we the optimize svg option is enabled
-        elif 'optimize' not in self.data or self.data['optimize'] != document._optimize_svg:
-            print('Reset cache du to optimize')
-            self.data = {}
-            self.remove_files()
-            
-        else:
+        # Statistics of the cache use for this build (see self.report)
+        self.touched = set()
+        self.stats = {}
+
+        # Entries store the inputs (beampy version, document options,
+        # theme, external tools) that affected their render, they are
+        # invalidated one by one in is_cached (see self.get_deps)
+        self.deps_values = {}
+
+        # Read entries written since the last build
+        self.store.refresh()
+
+        if not self.shared:
             #Restore glyphs definitions
-            if 'glyphs' in self.data:
-                document._global_store['glyphs'] = self.data['glyphs']
-                
-            
-            
-        #Add beampy version in data
-        self.data['version'] = self.version
-        self.data['optimize'] = document._optimize_svg
-        
+            glyphs = self.read_entry_blob('glyphs', 'glyphs')
+            if glyphs is not None:
+                document._global_store['glyphs'] = json.loads(glyphs)
+
+    @property
+    def data(self):
+        # Cache data are stored in the store index (a dict)
+        return self.store.index
+
     def remove_files(self):
-        for f in glob.glob(self.folder+'/*.pklz'):
-            os.remove(f)
-            
+        self.store.clear()
+
     def clear(self):
 
         if os.path.isdir(self.folder):
-            os.removedirs(self.folder)
+            shutil.rmtree(self.folder)
+
+        self.store = cache_store(self.folder, shared=self.shared)
+
+    def gc(self):
+        """
+        Remove from the cache folder the files that are no more used
+        by cache entries.
+        """
+
+        if self.shared:
+            return self.store.gc(min_age=self.shared_gc_min_age)
+
+        return self.store.gc()
+
+    def get_deps(self, bp_module):
+        """
+        Return a dict with the values of the inputs that affect the
+        render of the module. They are defined by the list
+        bp_module.cache_deps with the following names:
+
+        - 'theme': the THEME entry of the module (without x and y),
+        - 'optimize': document._optimize_svg,
+        - 'resize_raster': document._resize_raster,
+        - 'latex_packages': document._latex_packages,
+        - 'tool:name': the version of the external tool "name".
+
+        The beampy version is always included.
+        """
+
+        return self.get_deps_values(bp_module.cache_deps, bp_module.name)
+
+    def get_deps_values(self, cache_deps, module_name):
+        """
+        Return the dict of dependencies values for the list of
+        dependencies names cache_deps (see get_deps).
+        """
 
-        self.data = {}
+        from beampy.document import document
 
+        deps = {'version': self.version}
+        for dep in cache_deps:
+            if dep == 'theme':
+                key = 'theme:%s' % module_name
+            else:
+                key = dep
+
+            # Values are computed once for the build
+            if key not in self.deps_values:
+                if dep == 'theme':
+                    theme = dict((k, v) for k, v in document._theme.get(module_name, {}).items()
+                                 if k not in ('x', 'y'))
+                    value = hashlib.md5(json.dumps(theme, sort_keys=True,
+                                                   default=stable_repr).encode('utf-8')).hexdigest()
+                elif dep == 'optimize':
+                    value = document._optimize_svg
+                elif dep == 'resize_raster':
+                    value = document._resize_raster
+                elif dep == 'latex_packages':
+                    value = json.dumps(document._latex_packages, default=stable_repr)
+                elif dep.startswith('tool:'):
+                    from beampy.functions import tool_version
+                    value = tool_version(dep[5:])
+                else:
+                    raise KeyError('Unknown cache dependency %s for %s' % (dep, module_name))
+
+                self.deps_values[key] = value
+
+            deps[dep] = self.deps_values[key]
+
+        return deps
+
+    def read_entry_blob(self, key, name):
+        """
+        Return the decoded content of the blob "name" of the entry "key"
+        """
+
+        entry = self.store.get(key)
+        if entry is None or name not in entry.get('blobs', {}):
+            return None
+
+        content = self.store.get_blob(entry['blobs'][name])
+        if content is not None:
+            content = content.decode('utf-8')
+
+        return content
+
+    @synchronized
     def add_to_cache(self, slide, bp_module):
         """
         Add the element of a given slide to the cache data
@@ -92,64 +562,69 @@ class cache_slides():
             if bp_module.rendered:
                 #Set the uniq id from the element['content'] value of the element
                 elemid = create_element_id(bp_module, use_args=False, add_slide=False, slide_position=False)
-                
+
                 if elemid is not None:
-                    
-                    self.data[elemid] = {}
-                    
-                    #don't pickle matplotlib figure We don't need to store content in cache
-                    #if "matplotlib" not in str(type(bp_module)):
-                    #    self.data[elemid]['content'] = bp_module.content
-                        
-                    self.data[elemid]['width'] = bp_module.positionner.width.value
-                    self.data[elemid]['height'] = bp_module.positionner.height.value
-                    
+                    from beampy.functions import get_glyphs_subset, file_digest
+
+                    entry = {'blobs': {}, 'atime': time.time(),
+                             'deps': self.get_deps(bp_module)}
+
+                    entry['width'] = bp_module.positionner.width.value
+                    entry['height'] = bp_module.positionner.height.value
+
+                    # Outputs are stored in blobs named by their content digest
+                    for key in ['svgout', 'htmlout', 'jsout']:
+                        content = getattr(bp_module, key)
+                        if content is not None:
+                            entry['blobs'][key] = self.store.put_blob(content)
+
+                    # Store the glyphs used by the svg, they are
+                    # merged to the glyph store when the entry is read
                     if bp_module.svgout is not None:
-                        #create a temp filename
-                        svgoutname = tempfile.mktemp(prefix='svgout_', dir='')
-                        self.data[elemid]['svgout'] = svgoutname
-                        #save the file 
-                        self.write_file_cache(svgoutname, bp_module.svgout)
-                        
-                    if bp_module.htmlout is not None:
-                        htmloutname = tempfile.mktemp(prefix='htmlout_', dir='')
-                        self.data[elemid]['htmlout'] = htmloutname
-                        self.write_file_cache(htmloutname, bp_module.htmlout)
-                        
-                    if bp_module.jsout is not None:
-                        jsoutname = tempfile.mktemp(prefix='jsout_', dir='')
-                        self.data[elemid]['jsout'] = jsoutname
-                        self.write_file_cache(jsoutname, bp_module.jsout)
-
-                    #print(element['args'])
-                    #print(element.keys())
-                    #For commands that includes files, need a filename elements in args
+                        glyphs = get_glyphs_subset(bp_module.svgout)
+                        if len(glyphs) > 0:
+                            entry['glyphs'] = glyphs
+
+                    entry['size'] = sum([self.store.blob_size(d) for d in entry['blobs'].values()])
+                    entry['render_time'] = getattr(bp_module, 'render_time', 0)
+
+                    #For commands that includes files, store the digest of the file content
                     try:
-                        self.data[elemid]['file_id'] = os.path.getmtime( bp_module.content )
+                        entry['file_id'] = file_digest(bp_module.content)
                     except:
                         pass
 
+                    self.store.set(elemid, entry)
+
+    @synchronized
     def add_file(self, filename, content):
         """
         Function to add to the cache a file with it's content. It used to
         store required javascript libraries for instance.
         """
 
-        file_id = hash(filename)
-        self.data[file_id] = {'filename': filename}
-        self.write_file_cache(filename, content)
+        file_id = 'file:%s' % filename
+        digest = self.store.put_blob(content)
+        self.store.set(file_id, {'filename': filename,
+                                 'blobs': {'content': digest},
+                                 'size': self.store.blob_size(digest),
+                                 'atime': time.time()})
 
+    @synchronized
     def get_cached_file(self, filename):
         """
-        Try to get a given filename from cache 
+        Try to get a given filename from cache (return its content as bytes)
         """
 
-        file_id = hash(filename)
-        if file_id in self.data:
-            output_content = self.read_file_cache(filename)
-        else:
+        file_id = 'file:%s' % filename
+        output_content = None
+        if file_id in self.store:
+            output_content = self.store.get_blob(self.store.get(file_id)['blobs']['content'])
+            self.touched.add(file_id)
+
+        if output_content is None:
             print('File %s is not cached' % filename)
-            output_content = ''
+            output_content = b''
 
         return output_content
 
@@ -157,14 +632,10 @@ class cache_slides():
         """
         Check if a file with a given filename is in cache directory
         """
-        out = False
-        file_id = hash(filename)
 
-        if file_id in self.data:
-            out = True
+        return 'file:%s' % filename in self.store
 
-        return out
-    
+    @synchronized
     def is_cached(self, slide, bp_module):
         """
             Function to check if the given element is in the cache or not
@@ -174,69 +645,329 @@ class cache_slides():
         if bp_module.name not in ['group']:
             elemid = create_element_id(bp_module, use_args=False, add_slide=False, slide_position=False)
 
+            # An other process could have rendered this element
+            if self.shared and elemid is not None and elemid not in self.store:
+                self.store.refresh()
+
             #print(bp_module.name,":",elemid)
-            if elemid is not None and elemid in self.data:
-                cacheelem = self.data[elemid]
-                out = True
+            if elemid is not None and elemid in self.store:
+                from beampy.functions import merge_glyphs, file_digest
+                cacheelem = self.store.get(elemid)
+
+                # Check that inputs of the render have not changed
+                out = cacheelem.get('deps') == self.get_deps(bp_module)
+                if not out:
+                    _log.debug('Inputs of cached %s have changed' % bp_module.name)
 
-                #If it's from a file check if the file as changed
-                if 'file_id' in cacheelem:
+                #If it's from a file check if the file content as changed
+                if out and 'file_id' in cacheelem:
                     try:
-                        curtime = os.path.getmtime( bp_module.content )
+                        curdigest = file_digest(bp_module.content)
                     except:
-                        curtime = None
+                        curdigest = None
 
-                    if curtime != cacheelem['file_id']:
+                    if curdigest != cacheelem['file_id']:
                         out = False
                     else:
                         out = True
 
+                # Glyphs ids of the entry should not conflict with the glyph store
+                if out and 'glyphs' in cacheelem:
+                    out = merge_glyphs(cacheelem['glyphs'])
+                    if not out:
+                        _log.debug('Glyphs of cached %s conflict with the glyph store' % bp_module.name)
+
                 #If It's in cache load items from the cache to the object
                 if out:
-                    for key in ['svgout', 'jsout', 'htmlout']:
-                        if key in cacheelem:
-                            content = self.read_file_cache(cacheelem[key])
-                            setattr(bp_module, key, content)
+                    contents = {}
+                    for key, digest in cacheelem['blobs'].items():
+                        content = self.store.get_blob(digest)
+                        if content is None:
+                            # The blob has been removed from the cache folder
+                            _log.debug('Missing cache blob %s for %s' % (digest, bp_module.name))
+                            return False
+
+                        contents[key] = content.decode('utf-8')
+
+                    for key in contents:
+                        setattr(bp_module, key, contents[key])
 
                     #Update the size
                     bp_module.update_size(cacheelem['width'], cacheelem['height'])
 
+                    self.touched.add(elemid)
+                    self.add_stat(bp_module.name, 'time_saved', cacheelem.get('render_time', 0))
+
+            self.add_stat(bp_module.name, 'hits' if out else 'misses', 1)
+
+        return out
+
+    @synchronized
+    def get_text_render(self, key):
+        """
+        Return the latex render (a dict with the parsed svg, see
+        text.parse_latex_svg) stored for the text render key (see
+        functions.text_render_key) or None when it's not in cache.
+        """
+
+        entry_key = 'tex:%s' % key
+
+        # An other process could have rendered this text
+        if self.shared and entry_key not in self.store:
+            self.store.refresh()
+
+        out = None
+        entry = self.store.get(entry_key)
+        if entry is not None and entry.get('deps') == self.get_deps_values(self.text_deps, 'latex'):
+            from beampy.functions import merge_glyphs
+
+            svg = self.read_entry_blob(entry_key, 'svg')
+            if svg is not None and ('glyphs' not in entry or merge_glyphs(entry['glyphs'])):
+                out = dict(entry['render'])
+                out['svg'] = svg
+                self.touched.add(entry_key)
+                self.add_stat('latex', 'time_saved', entry.get('render_time', 0))
+
+        self.add_stat('latex', 'hits' if out is not None else 'misses', 1)
+
+        return out
+
+    @synchronized
+    def add_text_render(self, key, latex_render, render_time=0):
+        """
+        Store the latex render of a text (see get_text_render)
+        """
+
+        from beampy.functions import get_glyphs_subset
+
+        digest = self.store.put_blob(latex_render['svg'])
+        entry = {'blobs': {'svg': digest}, 'atime': time.time(),
+                 'deps': self.get_deps_values(self.text_deps, 'latex'),
+                 'size': self.store.blob_size(digest),
+                 'render_time': render_time}
+
+        entry['render'] = dict((k, v) for k, v in latex_render.items() if k != 'svg')
+        glyphs = get_glyphs_subset(latex_render['svg'])
+        if len(glyphs) > 0:
+            entry['glyphs'] = glyphs
+
+        self.store.set('tex:%s' % key, entry)
+
+    @synchronized
+    def get_slide_outputs(self, fingerprint):
+        """
+        Return the outputs of a slide (see exports.restore_slide) stored
+        for the slide fingerprint or None when they are not in cache.
+        """
+
+        entry_key = 'slide:%s' % fingerprint
+        if self.shared and entry_key not in self.store:
+            self.store.refresh()
+
+        out = None
+        entry = self.store.get(entry_key)
+        if entry is not None:
+            from beampy.functions import merge_glyphs
+
+            content = self.read_entry_blob(entry_key, 'outputs')
+            if content is not None and ('glyphs' not in entry or merge_glyphs(entry['glyphs'])):
+                out = json.loads(content)
+                # Json keys are strings, layers are int
+                for key in ['svglayers', 'htmlout', 'svgoverlays']:
+                    out[key] = dict((int(k), v) for k, v in out[key].items())
+
+                self.touched.add(entry_key)
+
+        self.add_stat('slide', 'hits' if out is not None else 'misses', 1)
+
+        return out
+
+    @synchronized
+    def add_slide_outputs(self, fingerprint, outputs, glyphs):
+        """
+        Store the outputs of a slide and the glyphs they use
+        """
+
+        digest = self.store.put_blob(json.dumps(outputs, sort_keys=True))
+        entry = {'blobs': {'outputs': digest}, 'atime': time.time(),
+                 'size': self.store.blob_size(digest)}
+        if len(glyphs) > 0:
+            entry['glyphs'] = glyphs
+
+        self.store.set('slide:%s' % fingerprint, entry)
+
+    @synchronized
+    def get_optimized_svg(self, key):
+        """
+        Return the svg optimized by scour for the optimization key (see
+        functions.optimize_svg) or None when it's not in cache.
+        """
+
+        entry_key = 'scour:%s' % key
+        if self.shared and entry_key not in self.store:
+            self.store.refresh()
+
+        out = None
+        entry = self.store.get(entry_key)
+        if entry is not None and entry.get('deps') == self.get_deps_values([], 'scour'):
+            out = self.read_entry_blob(entry_key, 'svg')
+            if out is not None:
+                self.touched.add(entry_key)
+                self.add_stat('scour', 'time_saved', entry.get('render_time', 0))
+
+        self.add_stat('scour', 'hits' if out is not None else 'misses', 1)
+
         return out
 
+    @synchronized
+    def add_optimized_svg(self, key, svg, render_time=0):
+        """
+        Store an svg optimized by scour (see get_optimized_svg)
+        """
+
+        digest = self.store.put_blob(svg)
+        self.store.set('scour:%s' % key, {'blobs': {'svg': digest},
+                                          'atime': time.time(),
+                                          'deps': self.get_deps_values([], 'scour'),
+                                          'size': self.store.blob_size(digest),
+                                          'render_time': render_time})
+
+    @synchronized
+    def get_pdf(self, svg_digest):
+        """
+        Return the pdf (as bytes) converted from an svg with the given
+        digest or None when it's not in cache.
+        """
+
+        entry_key = 'pdf:%s' % svg_digest
+        if self.shared and entry_key not in self.store:
+            self.store.refresh()
+
+        out = None
+        entry = self.store.get(entry_key)
+        if entry is not None and entry.get('deps') == self.get_deps_values(self.pdf_deps, 'pdf'):
+            out = self.store.get_blob(entry['blobs']['pdf'])
+            if out is not None:
+                self.touched.add(entry_key)
+                self.add_stat('pdf', 'time_saved', entry.get('render_time', 0))
+
+        self.add_stat('pdf', 'hits' if out is not None else 'misses', 1)
+
+        return out
+
+    @synchronized
+    def add_pdf(self, svg_digest, pdf_content, render_time=0):
+        """
+        Store the pdf converted from an svg (see get_pdf)
+        """
+
+        digest = self.store.put_blob(pdf_content)
+        self.store.set('pdf:%s' % svg_digest, {'blobs': {'pdf': digest},
+                                               'atime': time.time(),
+                                               'deps': self.get_deps_values(self.pdf_deps, 'pdf'),
+                                               'size': self.store.blob_size(digest),
+                                               'render_time': render_time})
+
+    def add_stat(self, module_name, key, value):
+        if module_name not in self.stats:
+            self.stats[module_name] = {'hits': 0, 'misses': 0, 'time_saved': 0}
+
+        self.stats[module_name][key] += value
+
+    def report(self):
+        """
+        Return a string with the statistics of the cache use
+        """
+
+        hits = sum([s['hits'] for s in self.stats.values()])
+        misses = sum([s['misses'] for s in self.stats.values()])
+        entries = [e for e in self.store.index.values() if isinstance(e, dict) and 'atime' in e]
+
+        out = 'Cache %s\n' % self.folder
+        out += 'entries: %i (%0.1f kB)\n' % (len(entries), sum([e.get('size', 0) for e in entries])/1024.)
+        out += 'hits: %i, misses: %i\n' % (hits, misses)
+        out += 'read: %0.1f kB, written: %0.1f kB\n' % (self.store.bytes_read/1024.,
+                                                       self.store.bytes_written/1024.)
+        out += '%-15s %8s %8s %15s\n' % ('module', 'hits', 'misses', 'time saved (s)')
+        for name in sorted(self.stats):
+            s = self.stats[name]
+            out += '%-15s %8i %8i %15.3f\n' % (name, s['hits'], s['misses'], s['time_saved'])
+
+        return out
+
+    def touch(self):
+        """
+        Update the access time of entries read during this build
+        """
+
+        tnow = time.time()
+        for key in self.touched:
+            entry = self.store.get(key)
+            if entry is not None and tnow - entry.get('atime', 0) > self.atime_resolution:
+                entry = dict(entry)
+                entry['atime'] = tnow
+                self.store.set(key, entry)
+
+        self.touched = set()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in
+        its budget (max_size and max_entries).
+        """
+
+        if self.max_size is None and self.max_entries is None:
+            return
+
+        entries = sorted([(e['atime'], k, e.get('size', 0)) for k, e in self.store.index.items()
+                          if isinstance(e, dict) and 'atime' in e])
+        size = sum([e[2] for e in entries])
+        nentries = len(entries)
+
+        for atime, key, esize in entries:
+            if ((self.max_size is None or size <= self.max_size) and
+                (self.max_entries is None or nentries <= self.max_entries)):
+                break
+
+            _log.debug('Evict cache entry %s' % key)
+            self.store.remove(key)
+            size -= esize
+            nentries -= 1
+
     def write_cache(self):
         """
-            Export cache data to a pickle file
+            Append new cache entries to the index file
         """
 
-        #Check if their is some glyphs in the global_store
-        if 'glyphs' in self.global_store:
-            self.data['glyphs'] = self.global_store['glyphs']
-            
-        with gzip.open(self.folder+'/'+self.data_file, 'wb') as f:
-            pkl.dump(self.data, f, protocol=2)
-            
-            
-    def write_file_cache(self, filename, content):
-        
-        with gzip.open(self.folder+'/'+filename+'.pklz', 'wb') as f:
-            try:
-                f.write(content.encode('utf-8'))
-            except Exception as e:
-                # Py 2 compatibility
-                f.write(content)
-
-    def read_file_cache(self, filename):
-        output = None
-        
-        with gzip.open(self.folder+'/'+filename+'.pklz', 'rb') as f:
-            try:
-                output = f.read().decode('utf-8')
-            except Exception as e:
-                # Python 2 compatibility
-                output = f.read()
-            
-        return output
-        
+        #Check if their is some glyphs in the global_store (shared
+        #cache entries store the glyphs they use)
+        if not self.shared and 'glyphs' in self.global_store:
+            glyphs = json.dumps(self.global_store['glyphs'], sort_keys=True)
+            digest = self.store.put_blob(glyphs)
+            old = self.store.get('glyphs')
+            if old is None or old['blobs']['glyphs'] != digest:
+                self.store.set('glyphs', {'blobs': {'glyphs': digest}})
+
+        self.touch()
+        self.evict()
+        self.store.flush()
+
+        # Remove blobs replaced during this build
+        if self.store.orphans:
+            self.gc()
+
+def stable_repr(value):
+    """
+    String representation of values that are not json serializable
+    (like functions in THEME), which is stable between two runs.
+    """
+
+    if callable(value):
+        return '%s.%s' % (getattr(value, '__module__', ''), getattr(value, '__name__', ''))
+
+    return str(value)
+
+
 #TODO: solve import bug when we try to import this function from beampy.functions...
 def create_element_id(bp_mod, use_args=True, use_render=True,
                       use_content=True, add_slide=True, slide_position=True,
@@ -12,6 +12,7 @@ from beampy import __version__ as bpversion
 import os
 import glob
 import inspect
+import multiprocessing
 from time import time
 
 bppath = os.path.dirname(__file__) + '/'
@@ -146,8 +147,12 @@ class document():
     _cache = None
     _pdf_animations = False
     _resize_raster = True
+    _latex_jobs = 1
+    _render_threads = 1
+    _pdf_shared_layers = False
     _source_code = []  # Store the source code of the input script
     _rendered = False  # Store the state of the entire document (allow multiformat output)
+    _output_file = None  # Store the file name given to the last save
 
     # Store data that need to be globally loaded in html like raster
     # contents images, video, etc...  Format of an entry in the list:
@@ -165,6 +170,11 @@ class document():
 
     # The TOC format should be TOC = ['title':'Subsublevel title', level:1]
     _TOC = []
+
+    # Keep cache_slides objects between documents (used by beampy watch
+    # to keep the cache loaded between builds)
+    _keep_cache = False
+    _kept_caches = {}
     
     # REMOVE globals=globals(), locals=locals() they are useless
     
@@ -180,6 +190,16 @@ class document():
             - text_box[False]: Draw box on slide elements to test width and height detection of elements (usefull to debug placement)
             - optimize[True]: Optimize svg using scour python script. This reduce the size but increase compilation time
             - cache[True]: Use cache system to not compile slides each times if nothing changed!
+            - shared_cache[None]: Path to a cache folder shared by several documents, which
+              could be built at the same time (like '~/.cache/beampy')
+            - cache_max_size[None]: Maximum size (in bytes) of the cache, least recently used elements are removed
+            - cache_max_entries[None]: Maximum number of elements in the cache
+            - latex_jobs['auto']: Number of latex processes run in parallel to render texts ('auto' use the
+              number of cpus)
+            - render_threads['auto']: Number of threads used to render modules of a slide which run external
+              tools, like tikz, figure or video ('auto' use the number of cpus)
+            - pdf_shared_layers[False]: In pdf exports, the first contents shared by all the layers of a
+              slide are stored once in the pdf and drawn below each layer (needs the pikepdf library)
             - resize_raster[True]: Resize raster images (inside svg and for jpeg/png figures)
             - theme: Define the path to your personal THEME dictionnaryXS
         """
@@ -288,9 +308,25 @@ class document():
         document._optimize_svg = good_values['optimize']
         document._resize_raster = good_values['resize_raster']
         document._output_format = good_values['format']
+        document._pdf_shared_layers = good_values['pdf_shared_layers']
+
+        if good_values['latex_jobs'] == 'auto':
+            document._latex_jobs = multiprocessing.cpu_count()
+        else:
+            document._latex_jobs = max(1, int(good_values['latex_jobs']))
+
+        if good_values['render_threads'] == 'auto':
+            document._render_threads = multiprocessing.cpu_count()
+        else:
+            document._render_threads = max(1, int(good_values['render_threads']))
         
         if not document._cache:
             document._cache = None
+        elif good_values['shared_cache'] is not None:
+            print("\nShared cache in %s" % (good_values['shared_cache']))
+            document._cache = self.open_cache(good_values['shared_cache'], shared=True,
+                                              max_size=good_values['cache_max_size'],
+                                              max_entries=good_values['cache_max_entries'])
         else:
             if self.source_filename is not None:
                 cache_file = './.beampy_cache_%s' % (self.source_filename)
@@ -298,10 +334,32 @@ class document():
                 cache_file = './.beampy_cache_%s' % (script_file_name)
                 
             print("\nChache file to %s" % (cache_file))
-            document._cache = cache_slides(cache_file, self)
+            document._cache = self.open_cache(cache_file,
+                                              max_size=good_values['cache_max_size'],
+                                              max_entries=good_values['cache_max_entries'])
 
         self.options = good_values
 
+    def open_cache(self, cache_dir, shared=False, max_size=None, max_entries=None):
+        """
+        Create the cache_slides of the document, or reuse the one of
+        the previous document when document._keep_cache is True.
+        """
+
+        key = (os.path.abspath(os.path.expanduser(cache_dir)), shared)
+        if document._keep_cache and key in document._kept_caches:
+            cache = document._kept_caches[key]
+            cache.max_size = max_size
+            cache.max_entries = max_entries
+            cache.start_build(self)
+        else:
+            cache = cache_slides(cache_dir, self, shared=shared, max_size=max_size,
+                                 max_entries=max_entries)
+            if document._keep_cache:
+                document._kept_caches[key] = cache
+
+        return cache
+
     def reset(self):
         document._contents = {}
         document._slides = {}
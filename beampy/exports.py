@@ -6,8 +6,38 @@ Created on Fri May 15 16:48:01 2015
 """
 
 from beampy.commands import document
-from beampy.functions import render_texts
+from beampy.functions import (render_texts, get_glyphs_subset, merge_glyphs, file_digest,
+                              tool_version)
+from beampy.cache import create_element_id, stable_repr
 import json
+import hashlib
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from subprocess import Popen, PIPE, STDOUT
+try:
+    from shlex import quote as shell_quote
+except ImportError:
+    # Python 2
+    from pipes import quote as shell_quote
+
+# Optional library to join pdf files (pdfjam is used otherwise)
+try:
+    from pypdf import PdfWriter
+except ImportError:
+    try:
+        from PyPDF2 import PdfWriter
+    except ImportError:
+        PdfWriter = None
+
+# Old versions of PyPDF2 can't append pdf files
+if PdfWriter is not None and not hasattr(PdfWriter, 'append'):
+    PdfWriter = None
+
+# Optional library to draw the shared contents of layers once in pdf
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
 try:
     from cStringIO import StringIO
 except:
@@ -52,10 +82,19 @@ def reset_module_rendered_flag():
 
 
 
-def save(output_file=None, format=None):
+def save(output_file=None, format=None, jobs=1, incremental=False):
     """
         Function to render the document to html
 
+        output_file: name of the output file (its extension gives the format)
+
+        format: force the output format ('html5', 'svg' or 'pdf')
+
+        jobs: number of processes used to render the slides (and of
+        inkscape processes for the pdf export)
+
+        incremental: reuse from the cache the outputs of slides which
+        have not changed since the previous build
     """
 
     _log.debug('Document at the begining of save method')
@@ -65,6 +104,7 @@ def save(output_file=None, format=None):
         sys.stdout = open(os.devnull, 'w')
 
     texp = time.time()
+    document._output_file = output_file
     bname = os.path.basename(output_file)
     bdir = output_file.replace(bname,'')
 
@@ -78,12 +118,14 @@ def save(output_file=None, format=None):
         document._output_format = 'html5'
         render_texts()
         save_layout()
+        render_document(jobs, incremental)
         output = html5_export()
 
     elif 'svg' in file_ext or format == "svg":
         document._output_format = 'svg'
         render_texts()
         save_layout()
+        render_document(jobs, incremental)
         output = svg_export(bdir+'/tmp')
         output_file = None
 
@@ -91,7 +133,8 @@ def save(output_file=None, format=None):
         document._output_format = 'pdf'
         render_texts()
         save_layout()
-        output = pdf_export(output_file)
+        render_document(jobs, incremental)
+        output = pdf_export(output_file, jobs)
 
         output_file = None
 
@@ -117,46 +160,487 @@ def save(output_file=None, format=None):
     print("="*20 + " BEAMPY END (%0.3f seconds) "%(time.time()-texp)+"="*20)
 
 
-def pdf_export(name_out):
+# Outputs of a slide render sent back by processes of render_slides
+SLIDE_OUTPUTS = ['svgout', 'svgdefout', 'htmlout', 'scriptout', 'animout',
+                 'svgheader', 'svgfooter', 'svglayers', 'svgshared', 'svgoverlays']
 
-    # External tools cmd
-    inkscapecmd = document._external_cmd['inkscape']
-    pdfjoincmd = document._external_cmd['pdfjoin']
 
-    # use inkscape to translate svg to pdf
-    svgcmd = inkscapecmd+" --without-gui  --file='%s' --export-pdf='%s' -d 300"
+def render_document(jobs=1, incremental=False):
+    """
+    Render the slides before their export (see render_slides). In
+    incremental mode, slides which have not changed since the previous
+    build are restored from the cache, the others are rendered and
+    their outputs are stored in the cache.
+    """
+
+    if not incremental or document._cache is None:
+        render_slides(jobs)
+        return
+
+    fingerprints = {}
+    for islide in range(document._global_counter['slide']+1):
+        slide = document._slides['slide_%i' % islide]
+        fingerprints[islide] = slide_fingerprint(slide)
+        if fingerprints[islide] is not None and restore_slide(slide, fingerprints[islide]):
+            print('Slide %i from cache' % islide)
+            fingerprints[islide] = None
+
+    render_slides(jobs)
+
+    for islide in range(document._global_counter['slide']+1):
+        slide = document._slides['slide_%i' % islide]
+        if fingerprints[islide] is not None:
+            if not slide.rendered:
+                slide.newrender()
+
+            store_slide(slide, fingerprints[islide])
+
+
+def slide_fingerprint(slide):
+    """
+    Return a digest of everything that defines the outputs of a slide:
+    the document size and format, the slide arguments and for each
+    module its id (args, content and position in the slide), cache id,
+    cache dependencies, layers, group and layout (position and size).
+
+    Return None when the slide can't be restored from cache (it
+    contains a module without cache or which depends on other slides).
+    """
+
+    parts = [document.__version__, document._width, document._height,
+             document._output_format, document._guide, document._text_box,
+             document._pdf_shared_layers,
+             slide.id, slide.num_layers, slide.title, slide.args]
+
+    for key in slide.element_keys:
+        elem = slide.contents[key]
+        if not elem.incremental or (elem.type != 'group' and not elem.cache):
+            return None
+
+        parts += [key, elem.name, elem.layers, elem.group_id,
+                  create_element_id(elem, use_args=False, add_slide=False, slide_position=False)]
+
+        # The layout of groups is not in their args
+        if elem.positionner is not None:
+            parts += [elem.positionner.x, elem.positionner.y,
+                      elem.positionner.width.value, elem.positionner.height.value]
+
+        if elem.type == 'group':
+            parts += [elem.background]
+
+        if elem.type != 'group':
+            parts += [document._cache.get_deps(elem)]
+
+            # Modules from files depend on their content
+            if isinstance(elem.content, str) and os.path.isfile(elem.content):
+                parts += [file_digest(elem.content)]
+
+    fingerprint = json.dumps(parts, sort_keys=True, default=stable_repr)
+
+    return hashlib.md5(fingerprint.encode('utf-8')).hexdigest()
+
+
+def restore_slide(slide, fingerprint):
+    """
+    Load the outputs of the slide from the cache (see store_slide).
+    Return True when the slide is restored.
+    """
+
+    outputs = document._cache.get_slide_outputs(fingerprint)
+    if outputs is None:
+        return False
+
+    for key in SLIDE_OUTPUTS:
+        setattr(slide, key, outputs[key])
+
+    slide.rendered = True
+    for key in slide.element_keys:
+        slide.contents[key].rendered = True
+
+    return True
+
+
+def store_slide(slide, fingerprint):
+    """
+    Store the outputs of the slide in the cache
+    """
+
+    outputs = dict((key, getattr(slide, key)) for key in SLIDE_OUTPUTS)
+    svg = ''.join(slide.svgdefout) + ''.join(slide.svglayers.values())
+    document._cache.add_slide_outputs(fingerprint, outputs, get_glyphs_subset(svg))
+
+
+def render_slides(jobs=1):
+    """
+    Render the slides which are not rendered yet (slides restored from
+    the cache are skipped) using a pool of jobs processes (nothing is
+    done when jobs is 1, slides are then rendered by the exports).
+
+    Slides are rendered in forked processes (they inherit the document)
+    which send back the outputs of the slide and the glyphs it uses.
+    """
+
+    islides = [islide for islide in range(document._global_counter['slide'] + 1)
+               if not document._slides['slide_%i' % islide].rendered]
+    if jobs <= 1 or len(islides) <= 1 or not hasattr(os, 'fork'):
+        return
+
+    try:
+        context = multiprocessing.get_context('fork')
+    except AttributeError:
+        # Python 2 always fork
+        context = multiprocessing
+
+    # Processes should not write again the pending cache entries
+    if document._cache is not None:
+        document._cache.store.flush()
+
+    print('Render slides with %i processes' % jobs)
+    pool = context.Pool(min(jobs, len(islides)))
+    results = pool.imap(render_slide_outputs, islides, chunksize=1)
+
+    for islide, outputs in zip(islides, results):
+        # Exceptions (and sys.exit) of the slide render are raised here
+        if isinstance(outputs, BaseException):
+            pool.terminate()
+            raise outputs
+
+        slide = document._slides['slide_%i' % islide]
+        for key in SLIDE_OUTPUTS:
+            setattr(slide, key, outputs[key])
+
+        slide.rendered = True
+
+        if outputs['glyphs'] and not merge_glyphs(outputs['glyphs']):
+            print('Glyphs of slide %i conflict with the glyph store' % islide)
+
+        if document._cache is not None:
+            for name, stats in outputs['cache_stats'].items():
+                for key, value in stats.items():
+                    document._cache.add_stat(name, key, value)
+
+            document._cache.touched.update(outputs['cache_touched'])
+
+    pool.close()
+    pool.join()
+
+    # Load cache entries added by the processes
+    if document._cache is not None:
+        document._cache.store.refresh()
+
+
+def render_slide_outputs(islide):
+    """
+    Render the slide number islide in a process of render_slides and
+    return its outputs (or the exception raised by its render).
+    """
+
+    slide = document._slides['slide_%i' % islide]
+
+    if document._cache is not None:
+        # Only send the statistics of this slide
+        document._cache.stats = {}
+        document._cache.touched = set()
+
+    # Modules call sys.exit on errors, which would kill the process and
+    # make the pool wait forever
+    try:
+        slide.newrender()
+    except BaseException as e:
+        return e
+
+    outputs = dict((key, getattr(slide, key)) for key in SLIDE_OUTPUTS)
+    svg = ''.join(slide.svgdefout) + ''.join(slide.svglayers.values())
+    outputs['glyphs'] = get_glyphs_subset(svg)
+
+    if document._cache is not None:
+        # Write the new cache entries for the main process
+        document._cache.store.flush()
+        outputs['cache_stats'] = document._cache.stats
+        outputs['cache_touched'] = list(document._cache.touched)
+
+    return outputs
+
+
+def cache_stats():
+    """
+    Print and return the statistics of the cache for the last build:
+    hits, misses, bytes read and written and time saved by module type.
+    """
+
+    if document._cache is None:
+        print('Cache is not enabled')
+        return None
+
+    print(document._cache.report())
+
+    return document._cache.stats
+
+
+def pdf_export(name_out, jobs=1):
+
     bdir = os.path.dirname(name_out)
 
+    shared_layers = document._pdf_shared_layers
+    if shared_layers and pikepdf is None:
+        print('pdf_shared_layers needs the pikepdf library, layers are exported as full pages')
+        shared_layers = False
+
     print('Render svg slides')
-    aa = svg_export(bdir+'/tmp')
+    # The svg files are rewritten by each build, their digests are
+    # computed from their content (not memoized with their mtime)
+    svg_digests = {}
+    aa = svg_export(bdir+'/tmp', shared_layers=shared_layers, digests=svg_digests)
 
     print('Convert svg to pdf with inkscape')
-    output_svg_names = []
+    tconvert = time.time()
+
+    # Digests of the svgs converted to the pdfs of the tmp folder by
+    # the previous builds
+    manifest_file = bdir+'/tmp/'+PDF_MANIFEST
+    manifest = read_pdf_manifest(manifest_file)
+
+    # Pages of the output as (pdf drawn below or None, pdf)
+    pages = []
+    svg_names = []
     for islide in range(document._global_counter['slide']+1):
-        print('slide %i'%islide)
-        for layer in range(document._slides['slide_%i'%islide].num_layers + 1):
-            print('layer %i'%layer)
-            #Use inkscape to render svg to pdf
-            res = os.popen(svgcmd%(bdir+'/tmp/slide_%i-%i.svg'%(islide, layer),
-                                   bdir+'/tmp/slide_%i-%i.pdf'%(islide, layer))
-                          )
-            res.close()
+        slide = document._slides['slide_%i'%islide]
+        shared_name = None
+        if shared_layers and has_shared_layers(slide):
+            shared_name = 'slide_%i-shared'%islide
+            svg_names += [shared_name]
+
+        for layer in range(slide.num_layers + 1):
+            svg_names += ['slide_%i-%i'%(islide, layer)]
+            pages += [(shared_name, 'slide_%i-%i'%(islide, layer))]
+
+    conversions = []
+    nreused = 0
+    for svg_name in svg_names:
+        svg_file = bdir+'/tmp/%s.svg'%svg_name
+        pdf_file = bdir+'/tmp/%s.pdf'%svg_name
+        svg_digest = svg_digests[svg_name]
+        pdf_name = os.path.basename(pdf_file)
+
+        # The pdf of the previous build is still good
+        if manifest['pdfs'].get(pdf_name) == svg_digest and os.path.exists(pdf_file):
+            nreused += 1
+            continue
+
+        # Layers with the same svg as a previous conversion are
+        # taken from the cache
+        pdf_content = None
+        if document._cache is not None:
+            pdf_content = document._cache.get_pdf(svg_digest)
+
+        if pdf_content is not None:
+            with open(pdf_file, 'wb') as f:
+                f.write(pdf_content)
+
+            manifest['pdfs'][pdf_name] = svg_digest
+        else:
+            conversions += [(svg_file, pdf_file)]
+            manifest['pdfs'].pop(pdf_name, None)
+
+    svgs_to_pdfs(conversions, jobs)
+
+    if len(conversions) > 0:
+        convert_time = (time.time() - tconvert) / len(conversions)
+        for svg_file, pdf_file in conversions:
+            svg_digest = svg_digests[os.path.basename(svg_file)[:-4]]
+            manifest['pdfs'][os.path.basename(pdf_file)] = svg_digest
+            if document._cache is not None:
+                with open(pdf_file, 'rb') as f:
+                    document._cache.add_pdf(svg_digest, f.read(), convert_time)
+
+    write_pdf_manifest(manifest_file, manifest)
 
-            output_svg_names += ['slide_%i-%i'%(islide, layer)]
+    print('%i svg converted to pdf in %0.3f seconds (%i unchanged, %i from cache)' % (
+        len(conversions), time.time()-tconvert, nreused,
+        len(svg_names)-len(conversions)-nreused))
 
     #join all pdf
-    res = os.popen(pdfjoincmd+' %s -o %s'%(' '.join(['"'+bdir+'/tmp/%s.pdf"'%sname for sname in output_svg_names]), name_out))
-    output = res.read()
+    pages = [(shared_name and bdir+'/tmp/%s.pdf'%shared_name, bdir+'/tmp/%s.pdf'%name)
+             for shared_name, name in pages]
+    if shared_layers:
+        join_pdfs_shared(pages, name_out)
+    else:
+        join_pdfs([pdf_file for shared_file, pdf_file in pages], name_out)
 
-    res.close()
     msg = "Saved to %s"%name_out
     #os.system('rm -rf %s'%(bdir+'/tmp/slide_*'))
 
     return msg
 
 
-def svg_export(dir_name, quiet=False):
-    # Export evry slides in svg inside a given folder
+# Name of the file, in the tmp folder of the pdf export, which stores
+# the digest of the svg converted to each pdf
+PDF_MANIFEST = 'pdf_manifest.json'
+
+
+def read_pdf_manifest(manifest_file):
+    """
+    Read the manifest of the pdf files converted by a previous export.
+    The manifest is empty when it does not exist or when it has been
+    written with an other version of inkscape.
+    """
+
+    manifest = {'inkscape': tool_version('inkscape'), 'pdfs': {}}
+    try:
+        with open(manifest_file) as f:
+            old_manifest = json.load(f)
+    except (IOError, ValueError):
+        old_manifest = {}
+
+    if old_manifest.get('inkscape') == manifest['inkscape']:
+        manifest['pdfs'] = old_manifest.get('pdfs', {})
+
+    return manifest
+
+
+def write_pdf_manifest(manifest_file, manifest):
+    # Write to a temporary file and rename it, a killed export never
+    # leaves a partial manifest
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, sort_keys=True)
+
+    os.rename(tmp_file, manifest_file)
+
+
+def svgs_to_pdfs(conversions, jobs=1):
+    """
+    Convert svg files to pdf with inkscape.
+
+    conversions: list of (svg_file, pdf_file)
+
+    jobs: number of inkscape processes. Files are shared between the
+    processes, each one runs in shell mode and converts all its files
+    without restarting inkscape.
+    """
+
+    if len(conversions) == 0:
+        return
+
+    njobs = max(1, min(jobs, len(conversions)))
+    groups = [conversions[i::njobs] for i in range(njobs)]
+
+    # Threads are enough as the work is done by inkscape processes
+    pool = ThreadPool(njobs)
+    outputs = pool.map(inkscape_shell_export, groups)
+    pool.close()
+    pool.join()
+
+    for (svg_file, pdf_file) in conversions:
+        if not os.path.exists(pdf_file):
+            print('Inkscape failed to convert %s to pdf' % svg_file)
+            print('\n'.join(outputs))
+            sys.exit(1)
+
+
+def inkscape_shell_export(conversions):
+    """
+    Convert a list of (svg_file, pdf_file) with one inkscape process
+    running in shell mode and return its output.
+    """
+
+    inkscapecmd = document._external_cmd['inkscape']
+
+    commands = []
+    for svg_file, pdf_file in conversions:
+        # An old pdf could hide a failed conversion
+        if os.path.exists(pdf_file):
+            os.remove(pdf_file)
+
+        commands += ['%s --export-pdf=%s -d 300' % (shell_quote(svg_file), shell_quote(pdf_file))]
+
+    commands += ['quit']
+
+    process = Popen(inkscapecmd + ' --shell', shell=True, stdin=PIPE,
+                    stdout=PIPE, stderr=STDOUT)
+    output = process.communicate(('\n'.join(commands) + '\n').encode('utf8'))[0]
+
+    return output.decode('utf8', errors='replace')
+
+
+def join_pdfs(pdf_files, name_out):
+    """
+    Join pdf files in a single pdf. Use pypdf (or PyPDF2) when it's
+    installed, otherwise use pdfjam (the pdfjoin external command).
+    """
+
+    if PdfWriter is not None:
+        # Pages are added one file at a time and written once
+        writer = PdfWriter()
+        for pdf_file in pdf_files:
+            writer.append(pdf_file)
+
+        with open(name_out, 'wb') as f:
+            writer.write(f)
+    else:
+        pdfjoincmd = document._external_cmd['pdfjoin']
+        res = os.popen(pdfjoincmd+' %s -o %s'%(' '.join(['"%s"'%pdf_file for pdf_file in pdf_files]), name_out))
+        output = res.read()
+        res.close()
+
+
+def join_pdfs_shared(pages, name_out):
+    """
+    Join pdf files in a single pdf with pikepdf. Pages are given as
+    (shared_file, pdf_file): the first page of shared_file is stored
+    once as a form XObject and drawn below each pdf_file using it.
+    """
+
+    output = pikepdf.Pdf.new()
+    opened = {}
+    shared_forms = {}
+
+    def open_pdf(pdf_file):
+        if pdf_file not in opened:
+            opened[pdf_file] = pikepdf.open(pdf_file)
+
+        return opened[pdf_file]
+
+    for shared_file, pdf_file in pages:
+        output.pages.append(open_pdf(pdf_file).pages[0])
+
+        if shared_file is not None:
+            if shared_file not in shared_forms:
+                shared_page = pikepdf.Page(open_pdf(shared_file).pages[0])
+                shared_forms[shared_file] = output.copy_foreign(shared_page.as_form_xobject())
+
+            pikepdf.Page(output.pages[-1]).add_underlay(shared_forms[shared_file])
+
+    output.save(name_out)
+
+    for pdf in opened.values():
+        pdf.close()
+
+
+def has_shared_layers(slide):
+    """
+    Check if the layers of the slide are split in shared contents and
+    overlays (see pdf_shared_layers document option)
+    """
+
+    return (slide.svgshared is not None and
+            all(layer in slide.svgoverlays for layer in range(slide.num_layers + 1)))
+
+
+def svg_export(dir_name, quiet=False, shared_layers=False, digests=None):
+    """
+    Export evry slides in svg inside a given folder
+
+    shared_layers: for slides with layers split in shared contents and
+    overlays, the shared contents are exported to slide_N-shared.svg
+    and layers only contain the overlay (used by pdf_export)
+
+    digests: a dict filled with the md5 digest of each svg file (the
+    keys are the file names without extension)
+    """
+
+    if digests is None:
+        digests = {}
 
     if quiet:
         sys.stdout = open(os.devnull, 'w')
@@ -175,22 +659,8 @@ def svg_export(dir_name, quiet=False):
         slide = document._slides["slide_%i"%islide]
 
         # Render the slide
-        slide.newrender()
-
-        # The global svg glyphs need also to be added to the html5 page
-        if 'glyphs' in document._global_store:
-            # OLD .decode('utf-8',errors='replace') after the join for py2
-            if py3:
-                glyphs_svg = '<defs>%s</defs>' % (
-                    ''.join([glyph['svg'] for glyph in document._global_store['glyphs'].values()]))
-            else:
-                _log.debug('Encode output as utf-8, for python2 compatibility')
-                glyphs_svg = '<defs>%s</defs>' % (
-                    ''.join([glyph['svg'] for glyph in document._global_store['glyphs'].values()]).decode('utf-8', errors='replace'))
-                
-
-        else:
-            glyphs_svg = ''
+        if not slide.rendered:
+            slide.newrender()
 
         # join all svg defs (old .decode('utf-8', errors='replace') after the join for py2)
         if py3:
@@ -199,35 +669,72 @@ def svg_export(dir_name, quiet=False):
             _log.debug('Encode output as utf-8, for python2 compatibility')
             def_svg = '<defs>%s</defs>'%(''.join(slide.svgdefout).decode('utf-8', errors='replace'))
             
-        for layer in range(slide.num_layers + 1):
+        svglayers = slide.svglayers
+        if shared_layers and has_shared_layers(slide):
+            svglayers = slide.svgoverlays
+            digests['slide_%i-shared'%islide] = write_svg_slide(dir_name+'slide_%i-shared.svg'%islide,
+                                                                slide, def_svg, slide.svgshared)
 
-            # save the list of rendered svg to a new dict as a string
-            tmp = slide.svgheader + glyphs_svg + def_svg
+        for layer in range(slide.num_layers + 1):
 
             # Join all the svg contents (old .decode('utf-8', errors='replace') for py2)
-            if layer in slide.svglayers:
+            if layer in svglayers:
                 if py3:
-                    tmp += slide.svglayers[layer]
+                    layer_svg = svglayers[layer]
                 else:
                     _log.debug('Encode output as utf-8, for python2 compatibility')
-                    tmp += slide.svglayers[layer].decode('utf-8', errors='replace')
+                    layer_svg = svglayers[layer].decode('utf-8', errors='replace')
 
             else:
-                tmp += '' #empty slide (when no svg are defined on slides)
-
-            # Add the svgfooter
-            tmp += slide.svgfooter
+                layer_svg = '' #empty slide (when no svg are defined on slides)
 
-            with io.open(dir_name+'slide_%i-%i.svg'%(islide, layer), 'w', encoding='utf8') as f:
-                if py3:
-                    f.write(tmp)
-                else:
-                    # For python 2
-                    f.write(tmp.decode('utf8', 'replace'))
+            digests['slide_%i-%i'%(islide, layer)] = write_svg_slide(dir_name+'slide_%i-%i.svg'%(islide, layer),
+                                                                     slide, def_svg, layer_svg)
 
     return "saved to "+dir_name
 
 
+def write_svg_slide(file_name, slide, def_svg, layer_svg):
+    """
+    Write the svg file of a layer of the slide and return the md5 digest
+    of its content
+    """
+
+    # Only the glyphs used by this layer are added
+    glyphs_svg = glyphs_svg_defs(def_svg + layer_svg)
+
+    # save the list of rendered svg to a new dict as a string
+    tmp = slide.svgheader + glyphs_svg + def_svg + layer_svg
+
+    # Add the svgfooter
+    tmp += slide.svgfooter
+
+    if not py3:
+        # For python 2
+        tmp = tmp.decode('utf8', 'replace')
+
+    with io.open(file_name, 'w', encoding='utf8') as f:
+        f.write(tmp)
+
+    return hashlib.md5(tmp.encode('utf8')).hexdigest()
+
+
+def glyphs_svg_defs(svg):
+    """
+    Return the svg defs with the glyphs of the global glyph store used
+    by the given svg.
+    """
+
+    glyphs = get_glyphs_subset(svg)
+    glyphs_svg = '<defs>%s</defs>' % (''.join([glyphs[key]['svg'] for key in sorted(glyphs)]))
+
+    if not py3:
+        _log.debug('Encode output as utf-8, for python2 compatibility')
+        glyphs_svg = glyphs_svg.decode('utf-8', errors='replace')
+
+    return glyphs_svg
+
+
 def html5_export():
 
     with open(curdir+'statics/jquery.js','r') as f:
@@ -291,7 +798,8 @@ def html5_export():
         slide = document._slides[slide_id]
 
         # Render the slide
-        slide.newrender()
+        if not slide.rendered:
+            slide.newrender()
 
         # Add a small peace of svg that will be used to get the data from the global store
         tmpout[slide_id]['svg'] = [] # Init the store for the differents layers
@@ -457,26 +965,21 @@ def display_matplotlib(slide_id, show=False):
     # Render the slide
     slide.newrender()
 
-    svgout = slide.svgheader
-
-    # Export glyphs
-    if 'glyphs' in document._global_store:
-        glyphs_svg = '<defs>%s</defs>' % (''.join([glyph['svg'] for glyph in document._global_store['glyphs'].values()]))
-        # old .decode('utf-8', errors='replace') for py2
-        svgout += glyphs_svg
-
     # join all svg defs (old .decode('utf-8', errors='replace') after join for py2)
     try:
-        svgout += '<defs>%s</defs>' % (''.join(slide.svgdefout))
+        svgout = '<defs>%s</defs>' % (''.join(slide.svgdefout))
     except Exception as e:
         # For py 2
-        svgout += '<defs>%s</defs>' % (''.join(slide.svgdefout)).decode('utf-8', errors='replace')
+        svgout = '<defs>%s</defs>' % (''.join(slide.svgdefout)).decode('utf-8', errors='replace')
 
     for layer in range(slide.num_layers + 1):
         # Join all the svg contents (old .decode('utf-8', errors='replace') for py2)
         if layer in slide.svglayers:
             svgout += slide.svglayers[layer]
 
+    # Export glyphs used by the slide
+    svgout = slide.svgheader + glyphs_svg_defs(svgout) + svgout
+
     # Add the svgfooter
     svgout += slide.svgfooter
 
@@ -16,12 +16,15 @@ from subprocess import check_call, check_output
 import tempfile
 import time
 import hashlib  # To create uniq id for elements
+import json
 
 import logging
 _log = logging.getLogger(__name__)
 
 # Lib to check the source code
 import inspect
+import threading
+from multiprocessing.pool import ThreadPool
 # Create REGEX pattern
 find_svg_tags = re.compile('id="(.*)"')
 # Regex to remove tab new line
@@ -154,45 +157,67 @@ def make_global_svg_defs_new_but_buggy(svg_soup):
     return svg_soup
 
 
-def make_global_svg_defs(svg_soup):
+# Find ids defined in svg and references to ids (href, xlink:href and url(#id))
+find_svg_ids = re.compile(r'''(?<![\w:.-])id\s*=\s*["']([^"']+)["']''')
+find_svg_id_refs = re.compile(r'''((?<![\w:.-])id\s*=\s*["']|href\s*=\s*["']#|url\(\s*["']?#)([^"')]+)''')
+find_url_refs = re.compile(r'''(url\(\s*["']?#)([^"')]+)''')
+
+
+def remap_svg_ids(svg, prefix):
     """
-        Function to use global counter for id in svg defs and use
+    Add a prefix to all the ids defined in an svg (given as a string)
+    and to their references (href, xlink:href and url(#id)).
 
-        svg_soup a BeautifulSoup object of the svg file
+    Ids are collected in a single pass and replaced in an other one, so
+    the time grows with the size of the svg and not with the number of
+    ids. The same svg and prefix always give the same output.
     """
 
-    # Test if it exist a svg_id global counter
-    if 'svg_id' not in document._global_counter:
-        document._global_counter['svg_id'] = 0  #init the counter
+    if isinstance(svg, bytes):
+        svg = svg.decode('utf-8')
 
-    #str_svg to replace modified id in all the svg content
-    strsvg = svg_soup.decode( eventual_encoding = 'utf8')
+    ids = set(find_svg_ids.findall(svg))
+    if len(ids) == 0:
+        return svg
 
-    #Find defs
-    svgdefs = svg_soup.find('defs')
-    #change_tags = ['path','clipPath','symbol','image', 'mask']
-    #change_tags = ['clipPath','mask','symbol','image']
-    #print(strsvg, svgdefs)
+    def prefix_id(match):
+        if match.group(2) in ids:
+            return match.group(1) + prefix + match.group(2)
 
-    #Create unique_id_ with time
-    text_id =  ("%0.4f"%time.time()).split('.')[-1]
-    if svgdefs is not None:
-        for tag in svgdefs.findAll(lambda x: x is not None and x.has_attr('id')):
-            oldid = tag['id']
-            newid = "%s_%i"%(text_id, document._global_counter['svg_id'])
-            strsvg = re.sub(oldid+'"', newid+'"', strsvg)
+        return match.group(0)
 
-            if tag.name in ['clipPath','linearGradient']:
-                strsvg = re.sub('(#'+oldid+')', '#'+newid, strsvg)
+    return find_svg_id_refs.sub(prefix_id, svg)
 
-            # print(oldid, newid)
-            document._global_counter['svg_id'] += 1
 
-    #Reparse the new svg
-    soup = BeautifulSoup(strsvg, 'xml')
-    #print('Svg refs changed in %0.4fs'%(time.time() - tps))
+# Opening tag of the svg root and attributes of a tag
+find_svg_root = re.compile(r'<svg(?=[\s/>])([^>]*)>')
+find_xml_attributes = re.compile(r'''([\w:.-]+)\s*=\s*(?:"([^"]*)"|'([^']*)')''')
+
+
+def split_svg_root(svg):
+    """
+    Return the attributes of the root <svg> tag (as a dict) and the
+    content of the svg inside this tag, without parsing the svg.
 
-    return soup
+    Return None when the root <svg> tag is not found or when the svg
+    defines xml entities (which need a parser).
+    """
+
+    root = find_svg_root.search(svg)
+    if root is None or '<!ENTITY' in svg[:root.start()]:
+        return None
+
+    attrs = dict((name, value1 or value2) for name, value1, value2 in
+                 find_xml_attributes.findall(root.group(1)))
+
+    if root.group(1).rstrip().endswith('/'):
+        return attrs, ''
+
+    end = svg.rfind('</svg>')
+    if end < root.end():
+        return None
+
+    return attrs, svg[root.end():end]
 
 
 def horizontal_centering(object_width, xinit=0, page_width=None):
@@ -257,6 +282,25 @@ def optimize_svg(svgfile_in):
     options['indent_type'] = None
     options['strip_comments'] = True
     #options['group_create'] = True #create group with identical element defs
+    # Round numbers with floats, Decimal is much slower on large figures
+    options['float_precision'] = True
+    # Large path data only get their precision reduced (with NumPy)
+    options['fast_path_threshold'] = OPTIMIZE_FAST_PATH_THRESHOLD
+
+    # Optimized svgs are cached with the digest of the svg and options
+    if isinstance(svgfile_in, bytes):
+        svg_bytes = svgfile_in
+    else:
+        svg_bytes = svgfile_in.encode('utf-8')
+
+    optimize_key = hashlib.md5(svg_bytes)
+    optimize_key.update(json.dumps(options, sort_keys=True, default=str).encode('utf-8'))
+    optimize_key = optimize_key.hexdigest()
+
+    if document._cache is not None:
+        svgout = document._cache.get_optimized_svg(optimize_key)
+        if svgout is not None:
+            return svgout
 
     #run scour
     #print('optimize svg...')
@@ -266,8 +310,148 @@ def optimize_svg(svgfile_in):
     print('optimize svg run in %f'%(time.time()-t))
     #print('done')
 
+    if document._cache is not None:
+        document._cache.add_optimized_svg(optimize_key, svgout, time.time()-t)
+
     return svgout
 
+
+# Minimum number of coordinates of a path to use the fast path cleaning
+# of scour (see scour.fastCleanPath)
+OPTIMIZE_FAST_PATH_THRESHOLD = 2000
+
+# Precompiled latex formats {preamble digest: (folder, name) or None}
+_latex_formats = {}
+_latex_formats_lock = threading.Lock()
+# Formats which have not been used during this time (in seconds) are removed
+LATEX_FORMAT_MAX_AGE = 7*24*3600
+def latex_format(preamble):
+    """
+    Build a latex format with the given preamble already loaded (using
+    the mylatexformat package). Latex runs using this format only pay
+    the cost of the document pages, which is a large part of the time
+    for small documents like a single text or tikz figure.
+
+    Formats are stored in the "latex_formats" folder of the cache (or
+    in the temporary folder when the cache is disabled). They are
+    named by a digest of the preamble and of the latex version, so they
+    are rebuilt when packages change.
+
+    Return
+    ------
+
+    (folder, name) of the format file or None if it can't be built.
+    """
+
+    key = hashlib.md5((preamble + tool_version('latex')).encode('utf-8')).hexdigest()
+    with _latex_formats_lock:
+        if key not in _latex_formats:
+            if document._cache is not None:
+                folder = os.path.join(document._cache.folder, 'latex_formats')
+            else:
+                folder = tempfile.gettempdir()
+
+            # Latex is run from the temporary folder
+            folder = os.path.abspath(folder)
+
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+
+            name = 'beampyfmt_%s' % key
+            fmt_file = os.path.join(folder, name + '.fmt')
+            _latex_formats[key] = None
+
+            if os.path.isfile(fmt_file):
+                # Update its modification time to keep it
+                os.utime(fmt_file, None)
+            else:
+                # Build it under a temporary name, other process could
+                # build the same format
+                jobname = '%s_%i' % (name, os.getpid())
+                with tempfile.NamedTemporaryFile(mode='w', prefix='beampytmp', suffix='.tex') as f:
+                    f.write(preamble)
+                    f.write(r'\begin{document}\end{document}')
+                    f.file.flush()
+
+                    cmd = 'cd %s && latex -ini -interaction=nonstopmode -jobname=%s "&latex" mylatexformat.ltx %s' % (folder, jobname, f.name)
+                    _log.debug(cmd)
+                    tex = os.popen(cmd)
+                    tex_outputs = tex.read()
+                    tex.close()
+
+                if os.path.isfile(os.path.join(folder, jobname + '.fmt')):
+                    os.rename(os.path.join(folder, jobname + '.fmt'), fmt_file)
+                else:
+                    _log.debug('Unable to build a latex format: %s' % tex_outputs)
+
+                for tmpf in glob.glob(os.path.join(folder, jobname + '.*')):
+                    os.remove(tmpf)
+
+                # Remove old formats
+                for old_fmt in glob.glob(os.path.join(folder, 'beampyfmt_*.fmt')):
+                    try:
+                        if time.time() - os.path.getmtime(old_fmt) > LATEX_FORMAT_MAX_AGE:
+                            os.remove(old_fmt)
+                    except OSError:
+                        pass
+
+            if os.path.isfile(fmt_file):
+                _latex_formats[key] = (folder, name)
+
+        return _latex_formats[key]
+
+
+def latex_command(latexstring):
+    """
+    Return the command to run latex on the given latex document. A
+    precompiled format of the document preamble is used when it's
+    possible (see latex_format).
+    """
+
+    cmd = 'latex'
+    if r'\begin{document}' in latexstring:
+        fmt = latex_format(latexstring.split(r'\begin{document}')[0])
+        if fmt is not None:
+            cmd = 'TEXFORMATS=%s: latex -fmt=%s' % fmt
+
+    return cmd
+
+
+def latex_failed(tex_outputs):
+    """
+    Check if the output of a latex run contains errors
+    """
+
+    return tex_outputs is None or 'error' in tex_outputs or '!' in tex_outputs
+
+
+def run_latex(tex_file, latex_cmd, options=''):
+    """
+    Run latex on tex_file from the temporary folder and return its output.
+    When latex_cmd uses a precompiled format and fails, latex is run again
+    without the format.
+    """
+
+    latex_cmds = [latex_cmd]
+    if latex_cmd != 'latex':
+        latex_cmds += ['latex']
+
+    for cmd in latex_cmds:
+        cmd = 'cd %s && %s -interaction=nonstopmode %s %s' % (tempfile.gettempdir(), cmd,
+                                                              options, tex_file)
+        _log.debug(cmd)
+        tex = os.popen(cmd)
+        tex_outputs = tex.read()
+        tex.close()
+
+        if not latex_failed(tex_outputs):
+            break
+
+        _log.debug(tex_outputs)
+
+    return tex_outputs
+
+
 def latex2svg(latexstring, write_tmpsvg=False):
     """
         Command to render latex -> dvi -> svg
@@ -289,9 +473,6 @@ def latex2svg(latexstring, write_tmpsvg=False):
     tmpname = None
     tex_outputs = None
 
-    # Get the temporary dir location
-    tmppath = tempfile.gettempdir()
-
     with tempfile.NamedTemporaryFile(mode='w', prefix='beampytmp', suffix='.tex') as f:
         # Get the name of the file
         tmpname, tmpextension = os.path.splitext(f.name)
@@ -303,9 +484,7 @@ def latex2svg(latexstring, write_tmpsvg=False):
         f.file.flush()
 
         #Run Latex
-        #t = time.time()
-        tex = os.popen("cd "+tmppath+" && latex -interaction=nonstopmode "+f.name)
-        #print('latex run in %f'%(time.time()-t))
+        tex_outputs = run_latex(f.name, latex_command(latexstring))
         #print tex.read() #To print tex output
         """
         This is a test to get the base line from latex output
@@ -321,11 +500,9 @@ def latex2svg(latexstring, write_tmpsvg=False):
         #Convert latex pt to cm (1pt = 28.4cm)
         #tex_em = "%0.5fcm"%(float(tex_em[2:-3]) * 1/28.4)
         #convert to pixel
-        tex_outputs = tex.read()
-        tex.close() # close the os.popen
 
     #Run dvi2svgm
-    if tex_outputs is None or 'error' in tex_outputs or '!' in tex_outputs:
+    if latex_failed(tex_outputs):
         print('Latex compilation error')
         print(tex_outputs)
         #Remove temp files
@@ -404,6 +581,157 @@ def clean_ghostscript_warnings(rawsvg):
     return good_svg
 
 
+# Memoized versions of external tools {name: version}
+_tool_versions = {}
+
+
+def tool_version(name):
+    """
+    Return the first line of the version message of an external tool
+    (as defined in document._external_cmd, or 'latex'). Return an empty
+    string if the tool is not available.
+    """
+
+    if name not in _tool_versions:
+        if name == 'latex':
+            cmd = 'latex'
+        else:
+            cmd = document._external_cmd.get(name)
+
+        version = ''
+        if cmd is not None:
+            # ffmpeg and avconv only know the -version option
+            if name == 'video_encoder':
+                cmd += ' -version'
+            else:
+                cmd += ' --version'
+
+            try:
+                output = check_output(cmd, shell=True, stderr=open(os.devnull, 'w'))
+                version = output.decode('utf8', errors='replace').strip().splitlines()[0]
+            except Exception as e:
+                _log.debug('Unable to get the version of %s: %s' % (name, e))
+
+        _tool_versions[name] = version
+
+    return _tool_versions[name]
+
+
+# Memoized digests of files {(path, size, mtime): digest}
+_file_digests = {}
+
+
+def file_digest(file_name):
+    """
+    Return the md5 digest of the content of a file.
+
+    The digest is memoized using the path, the size and the
+    modification time of the file, so an unchanged file is read only
+    once per build. A file with a new mtime but the same content
+    (like after a git checkout) keeps the same digest.
+    """
+
+    stat = os.stat(file_name)
+    key = (os.path.abspath(file_name), stat.st_size, stat.st_mtime)
+
+    if key not in _file_digests:
+        md5 = hashlib.md5()
+        with open(file_name, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                md5.update(chunk)
+
+        _file_digests[key] = md5.hexdigest()
+
+    return _file_digests[key]
+
+
+# Find references to glyphs of the global store (g_ ids)
+find_glyph_refs = re.compile(r'xlink:href=[\'"]#(g_[^\'"]+)[\'"]')
+
+
+def get_glyphs_subset(svg, glyphs=None):
+    """
+    Return the part of the global glyph store used by the given svg.
+
+    Glyph aliases (<use> defined in the store) are followed to also
+    include the glyph path they refer to.
+
+    Parameters
+    ----------
+
+    svg : str,
+        The svg content to scan for glyph references.
+
+    glyphs : dict or None, optional
+        The glyph store (the default is None, which implies
+        document._global_store['glyphs']).
+
+    Return a dict {store_key: glyph} (empty if no glyphs are used).
+    """
+
+    if glyphs is None:
+        glyphs = document._global_store.get('glyphs', {})
+
+    subset = {}
+    refs = set(find_glyph_refs.findall(svg))
+    if len(refs) == 0 or len(glyphs) == 0:
+        return subset
+
+    ids = dict((g['id'], key) for key, g in glyphs.items())
+    while len(refs) > 0:
+        gid = refs.pop()
+        if gid in ids and ids[gid] not in subset:
+            key = ids[gid]
+            subset[key] = glyphs[key]
+            # Follow aliases
+            refs.update(find_glyph_refs.findall(glyphs[key]['svg']))
+
+    return subset
+
+
+def merge_glyphs(subset):
+    """
+    Add glyphs (like those returned by get_glyphs_subset) to the global
+    glyph store.
+
+    Return False, without changing the store, when one glyph conflicts
+    with the store (the same glyph with an other id or the same id
+    for an other glyph).
+    """
+
+    if 'glyphs' not in document._global_store:
+        document._global_store['glyphs'] = {}
+
+    glyphs = document._global_store['glyphs']
+    ids = None
+    for key, glyph in subset.items():
+        if key in glyphs:
+            if glyphs[key]['id'] != glyph['id']:
+                return False
+        else:
+            if ids is None:
+                ids = set(g['id'] for g in glyphs.values())
+
+            if glyph['id'] in ids:
+                return False
+
+    glyphs.update(subset)
+
+    return True
+
+
+def glyph_id(content):
+    """
+    Return the id of a glyph of the global glyph store from its content
+    (the "d" attribute of a glyph path, or the svg of a glyph alias).
+
+    Ids do not depend on the render order, so svg of texts rendered
+    in other builds (cache, parallel renders) can be mixed.
+    """
+
+    return 'g_%s' % hashlib.md5(content.encode('utf-8')).hexdigest()[:12]
+
+
 def getsvgwidth( svgfile ):
     """
         get svgfile width using inkscape
@@ -811,125 +1139,178 @@ def render_texts(elements_to_render=None, extra_packages=None):
                     elements_to_render += [e]
 
 
+    # Pages of texts already added to the latex file {text_render_key: page}
+    pages_keys = {}
     for e in elements_to_render:
-        if e.cache and document._cache is not None:
+        use_cache = e.cache and document._cache is not None
+        if use_cache:
             _log.debug('Render_texts test cache for element %s(id=%s) on slide: %s' % (e.name, e.id, e.slide_id))
-            ct_cache = document._cache.is_cached(e.slide_id, e)
-            if ct_cache is False:
-                # Run the pre_rendering
-                e.pre_render()
-
-                try:
-                    latex_pages += [e.latex_text]
-                    elements_pages += [{"element": e, "page": cpt_page}]
-                    cpt_page += 1
-                except Exception as e:
-                    print(e)
-        else:
+            if document._cache.is_cached(e.slide_id, e):
+                continue
 
-            e.pre_render()
+        # Run the pre_rendering
+        e.pre_render()
 
-            try:
+        try:
+            # The same latex text could already have been rendered
+            # (for this document or an other one sharing the cache)
+            e.text_render_key = text_render_key(latex_header, e.latex_text)
+            if use_cache:
+                e.latex_render = document._cache.get_text_render(e.text_render_key)
+                if e.latex_render is not None:
+                    continue
+
+            if e.text_render_key in pages_keys:
+                elements_pages += [{"element": e, "page": pages_keys[e.text_render_key]}]
+            else:
                 latex_pages += [e.latex_text]
                 elements_pages += [{"element": e, "page": cpt_page}]
+                pages_keys[e.text_render_key] = cpt_page
                 cpt_page += 1
-            except Exception as e:
-                print(e)
+        except Exception as e:
+            print(e)
 
 
     _log.debug(latex_header+'\n \\newpage \n'.join(latex_pages)+latex_footer)
     # Write the file to latex
     if len(latex_pages) > 0:
-        # get the location of tempdir
-        tmppath = tempfile.gettempdir()
+        tlatex = time.time()
+
+        # Use a precompiled format of the preamble
+        latex_cmd = latex_command(latex_header)
+
+        # Elements of each page
+        pages_elements = {}
+        for ep in elements_pages:
+            pages_elements.setdefault(ep['page']-1, []).append(ep['element'])
+
+        def set_svgtext(ipage, svg):
+            for e in pages_elements[ipage]:
+                e.svgtext = svg
+
+        # Split pages in shards compiled by parallel latex processes
+        njobs = min(document._latex_jobs,
+                    (len(latex_pages) + LATEX_MIN_PAGES_PER_JOB - 1) // LATEX_MIN_PAGES_PER_JOB)
+        if njobs > 1:
+            shard_size = (len(latex_pages) + njobs - 1) // njobs
+
+            def compile_shard(start):
+                return compile_latex_pages(latex_header, latex_pages[start:start+shard_size],
+                                           latex_footer,
+                                           lambda ipage, svg: set_svgtext(start+ipage, svg),
+                                           latex_cmd)
+
+            # Threads are enough as the work is done by latex and
+            # dvisvgm processes
+            starts = list(range(0, len(latex_pages), shard_size))
+            pool = ThreadPool(len(starts))
+            results = pool.map(compile_shard, starts)
+            pool.close()
+            pool.join()
+        else:
+            results = [compile_latex_pages(latex_header, latex_pages, latex_footer,
+                                           set_svgtext, latex_cmd)]
+
+        npages = 0
+        for tex_outputs, shard_pages in results:
+            if shard_pages is None:
+                print(tex_outputs)
+                print('Latex compilation error')
+                # Stop Beampy compilation
+                sys.exit(1)
 
-        # Create a None tempory filename
-        tmpname = None
+            npages += shard_pages
 
-        # Create a variable to store the latex output
-        tex_outputs = None
+        _log.debug('Size of svg %i and size of latex pages %i'%(npages, len(latex_pages)))
+        assert npages == len(latex_pages)
 
-        # Use tempfile.NamedTemporaryFile to create a text file with .tex suffix and beampytmp prefix
-        # NamedTemporaryFile automaticly close the file at the end of the context by default
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.tex', prefix='beampytmp') as f:
-            # Get the name of the file
-            tmpname, extension = os.path.splitext(f.name)
+        print('Latex -> DVI -> SVG in %f (%i jobs)'%(time.time()-tlatex, len(results)))
 
-            # Write down the latex code to this file
-            f.write(latex_header)
-            f.write('\n \\newpage \n'.join(latex_pages))
-            f.write(latex_footer)
+        # Mean time of latex and dvisvgm for one page (for cache statistics)
+        latex_time = (time.time() - tlatex) * len(results) / len(latex_pages)
+        for ep in elements_pages:
+            ep['element'].latex_time = latex_time
 
-            print('Latex file writen in %f'%(time.time()-t))
 
-            # Flush the file content so that latex can see it
-            f.file.flush()
+# Minimum number of pages given to a latex process in render_texts
+LATEX_MIN_PAGES_PER_JOB = 20
+def compile_latex_pages(latex_header, latex_pages, latex_footer, page_callback,
+                        latex_cmd='latex'):
+    """
+    Run latex and dvisvgm on a list of latex pages.
 
-            #Run Latex using subprocess
-            #t = time.time()
-            cmd = "cd "+tmppath+" && latex -interaction=nonstopmode --halt-on-error "+f.name
-            _log.debug(cmd)
+    page_callback(page_index, svg) is called with the svg of each page
+    as soon as it's read.
 
-            tex = os.popen(cmd)
-            #print('Latex run in %f'%(time.time()-t))
-            tex_outputs = tex.read()
-            _log.debug(tex_outputs)
-            tex.close() # close os.popen
+    latex_cmd is the command to run latex (see latex_command).
 
+    Return
+    ------
 
-        # to test the output of latex file
-        """
-        with open('test_text_py2.tex', 'w') as f:
-            f.write(latex_header)
-            f.write('\n \\newpage \n'.join(latex_pages))
-            f.write(latex_footer)
-        """
+    (tex_outputs, npages): the output of latex and the number of svg
+    pages (npages is None if the latex compilation fails).
+    """
 
-        if tex_outputs is None or 'error' in tex_outputs or '!' in tex_outputs:
-            print(tex_outputs)
-            print('Latex compilation error')
-            #Remove temp files generated by latex
-            for f in glob.glob(tmpname+'*'):
-                os.remove(f)
+    # Create a variable to store the latex output
+    tex_outputs = None
+
+    # Use tempfile.NamedTemporaryFile to create a text file with .tex suffix and beampytmp prefix
+    # NamedTemporaryFile automaticly close the file at the end of the context by default
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.tex', prefix='beampytmp') as f:
+        # Get the name of the file
+        tmpname, extension = os.path.splitext(f.name)
 
-            # Stop Beampy compilation
-            sys.exit(1)
+        # Write down the latex code to this file
+        f.write(latex_header)
+        f.write('\n \\newpage \n'.join(latex_pages))
+        f.write(latex_footer)
 
-        #Upload svg to each elements
+        # Flush the file content so that latex can see it
+        f.file.flush()
+
+        #Run Latex
+        tex_outputs = run_latex(f.name, latex_cmd, '--halt-on-error')
+        _log.debug(tex_outputs)
+
+    npages = None
+    if not latex_failed(tex_outputs):
         dvisvgmcmd = document._external_cmd['dvisvgm']
 
-        t = time.time()
-        if tmpname is not None:
-            cmd = dvisvgmcmd+' -n -s -p1- --linkmark=none -v0 '+tmpname+'.dvi'
-            allsvgs = check_output(cmd, shell=True).decode('utf8', errors='replace')
-            allsvgs = allsvgs.splitlines()
+        # Write one svg file per page, they are read one by one to
+        # keep the memory bounded for large number of pages
+        cmd = dvisvgmcmd+' -n -p1- --linkmark=none -v0 -o '+tmpname+'-%p.svg '+tmpname+'.dvi'
+        _log.debug(cmd)
+        check_output(cmd, shell=True)
+
+        svg_files = {}
+        for svg_file in glob.glob(tmpname+'-*.svg'):
+            svg_files[int(svg_file[len(tmpname)+1:-4])] = svg_file
 
-            #To split the data get the xml syntax <? xml ....?>
-            schema = get_xml_tag(allsvgs)
-            _log.debug('Schema to cut svg %s'%(str(schema)))
-            assert schema is not None
+        npages = len(svg_files)
+        for ipage in sorted(svg_files):
+            with open(svg_files[ipage]) as svgf:
+                # Remove new lines like the old stdout processing
+                svg = ''.join(svgf.read().splitlines())
 
             # Check if their is warning emitted by dvisvgm inside the svgfile
-            allsvgs = clean_ghostscript_warnings(allsvgs)
+            page_callback(ipage-1, clean_ghostscript_warnings(svg))
+            os.remove(svg_files[ipage])
 
-            #Join all svg lines and split them each time you find the schema
-            svg_list = ''.join(allsvgs).split(schema)
-            if svg_list[0] == '':
-                svg_list = svg_list[1:]
+    #Remove temp files generated by latex
+    for f in glob.glob(tmpname+'*'):
+        os.remove(f)
 
-            _log.debug('Size of svg %i and size of latex pages %i'%(len(svg_list), len(elements_pages)))
-            assert len(svg_list) == len(elements_pages)
+    return tex_outputs, npages
 
-            #Process all pages to svg
-            for i, ep in enumerate(elements_pages):
-                #Loop over content in the slide
-                ep['element'].svgtext = schema + svg_list[i]
 
-        print('DVI -> SVG in %f'%(time.time()-t))
+def text_render_key(preamble, latex_text):
+    """
+    Return the key of a latex text render for the text render cache
+    (see cache_slides.get_text_render). It depends on the full latex
+    preamble and on the latex code of the text.
+    """
 
-        #Remove temp files generated by latex
-        for f in glob.glob(tmpname+'*'):
-            os.remove(f)
+    return hashlib.md5((preamble + latex_text).encode('utf-8')).hexdigest()
 
 
 PYTHON_XMLFIND_REGEX = re.compile(r'<\?xml[^>]+>')
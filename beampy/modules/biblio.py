@@ -221,6 +221,7 @@ class cite(text):
         # self.check_args_from_theme(kwargs)
         self.load_extra_args('text')
         self.svgtext = ''  # To store the svg produced by latex
+        self.latex_render = None  # To store the parsed svg of latex
 
         if isinstance(reference, str):
             references = [reference]
@@ -250,6 +251,7 @@ class cite(text):
         self.initial_width = self.width
         self.args_for_cache_id = ['initial_width', 'color', 'size',
                                   'align', 'opacity']
+        self.cache_deps = ['theme', 'latex_packages', 'tool:latex', 'tool:dvisvgm']
 
 
         # Initialise the global store on document._content to store letter
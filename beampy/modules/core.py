@@ -15,6 +15,7 @@ from beampy.geometry import positionner, distribute
 import sys
 import time
 import inspect
+from multiprocessing.pool import ThreadPool
 
 import logging
 _log = logging.getLogger(__name__)
@@ -81,6 +82,9 @@ class slide(object):
         self.svgheader = ''
         self.svgfooter = '\n</svg>\n'
         self.svglayers = {}  # Store slide final svg (without svg defs stored in self.svgdefout) for the given layer
+        self.svgshared = None  # Store the svg of the first contents shared by all layers (for pdf_shared_layers)
+        self.svgoverlays = {}  # Store the svg of the other contents of each layer (for pdf_shared_layers)
+        self.rendered = False  # Is the slide already rendered (outputs are ready to export)
         
         # Do we need to render the THEME layout on this slide
         self.render_layout = True
@@ -189,6 +193,9 @@ class slide(object):
         self.svgheader = ''
         self.svgfooter = '\n</svg>\n'
         self.svglayers = {}  # Store slide final svg (without svg defs stored in self.svgdefout) for the given layer
+        self.svgshared = None
+        self.svgoverlays = {}
+        self.rendered = False
         
 
     def __enter__(self):
@@ -310,13 +317,25 @@ class slide(object):
         if self.title_element is not None:
             self.title_element.add_layers(list(range(self.num_layers+1)))
 
+        # Modules waiting for external tools are rendered together in threads
+        threaded = [self.contents[key] for key in self.element_keys
+                    if self.contents[key].type != 'group' and self.contents[key].threaded_render
+                    and not self.contents[key].rendered]
+        if document._render_threads > 1 and len(threaded) > 1:
+            render_in_threads(threaded, document._render_threads)
+            threaded_ids = set(elem.id for elem in threaded)
+        else:
+            threaded_ids = set()
+
         # First loop over slide's modules to render them (to get height and width)
-        # Todo: do that using multiprocessing
         for i, key in enumerate(self.element_keys):
             elem = self.contents[key]
 
             if elem.type != 'group':
-                if not elem.rendered:
+                if key in threaded_ids:
+                    # Svg definitions are added in the order of elements
+                    elem.render_svgdefs()
+                elif not elem.rendered:
                     # Run the pre render method of each modules
                     elem.pre_render()
                     # print('main loop run_render')
@@ -356,6 +375,10 @@ class slide(object):
                     except Exception as e:
                         # TODO ADD a log to this try
                         print('no svg for layer %i' % layer)
+
+                # Split layers in shared contents and overlays for the pdf export
+                if document._output_format == 'pdf' and document._pdf_shared_layers:
+                    self.svgshared, self.svgoverlays = curgroup.export_svg_shared_layers()
                         
 
                 #Need to deal with html module
@@ -401,6 +424,32 @@ class slide(object):
                                               height=document._height,
                                               bgcolor=self.args['background'])
         self.svgheader = header_template
+        self.rendered = True
+
+
+def render_in_threads(modules, nthreads):
+    """
+    Run the pre_render and the render of modules in a pool of nthreads
+    threads. Svg definitions of modules are not processed (see
+    beampy_module.run_render).
+    """
+
+    def render(module):
+        # Exceptions (and sys.exit) are raised in the main thread
+        try:
+            module.pre_render()
+            module.render_module()
+        except BaseException as e:
+            return e
+
+    pool = ThreadPool(min(nthreads, len(modules)))
+    errors = pool.map(render, modules)
+    pool.close()
+    pool.join()
+
+    for error in errors:
+        if error is not None:
+            raise error
 
 
 class beampy_module(object):
@@ -446,6 +495,19 @@ class beampy_module(object):
     
     #Do cache for this element or not
     cache = True
+
+    # Inputs (other than the cache id) that change the render of the
+    # module, when one changes the cached render is invalidated (see
+    # cache_slides.get_deps)
+    cache_deps = ['theme']
+
+    # The render mostly waits for external tools (latex, inkscape,
+    # ffmpeg...), it could be run in a thread (see slide.newrender)
+    threaded_render = False
+
+    # The module could be restored with its slide from the previous
+    # build when the slide has not changed (see exports.slide_fingerprint)
+    incremental = True
  
     #Save the id of the current slide for the module
     slide_id = None
@@ -567,6 +629,17 @@ class beampy_module(object):
         self.rendered = True
 
     def run_render(self):
+        """
+            Run the function self.render if the module is not in cache
+            and process its svg definitions
+        """
+
+        self.render_module()
+
+        # Process the svg definitions
+        self.render_svgdefs()
+
+    def render_module(self):
         """
             Run the function self.render if the module is not in cache
         """
@@ -587,7 +660,10 @@ class beampy_module(object):
             else:
                 #print("element %i not cached"%ct['positionner'].id)
                 if not self.rendered:
+                    trender = time.time()
                     self.render()
+                    # Store the render time for cache statistics
+                    self.render_time = time.time() - trender
                     _log.debug('Add %s(id=%s) cache for slide_id: %s' % (self.name, self.id, slide.num))
                     document._cache.add_to_cache('slide_%i'%slide.num, self)
                     try:
@@ -602,9 +678,6 @@ class beampy_module(object):
                 except:
                     print("Elem %s rendered"%self.name)
 
-        # Process the svg definitions
-        self.render_svgdefs()
-
     def get_name(self):
         # Return the name of the module
         # return str(self.__init__.im_class).split('.')[-1]
@@ -1493,30 +1566,37 @@ class group(beampy_module):
         
         self.rendered = True
 
-    def export_svg_content_layer(self, layer):
+    def export_svg_content_layer(self, layer, start=0, stop=None):
         """
         Function to export group content for a given layer to svg
         :param layer:
+        :param start, stop: only export the contents [start:stop] of the layer
+        (the background is exported with the first content)
         :return:
         """
 
-        if self.background is not None:
+        if self.background is not None and start == 0:
             pre_rect = '<rect width="%s" height="%s" style="fill:%s;" />'%(self.width.value,
              self.height.value, self.background)
         else:
             pre_rect = ''
 
-        output = pre_rect + ''.join(self.content_layer[layer])
+        output = pre_rect + ''.join(self.content_layer[layer][start:stop])
 
         return output
 
-    def export_svg_layer(self, layer):
+    def export_svg_layer(self, layer, start=0, stop=None):
 
         out = '<g transform="translate(%s,%s)" class="%s" data-layer="%i">' % (self.positionner.x['final'],
                                                                                self.positionner.y['final'],
                                                                                self.name, layer)
 
-        out += self.export_svg_content_layer(layer)
+        out += self.export_svg_content_layer(layer, start, stop)
+
+        # Box and decoration are only drawn with the last contents
+        if stop is not None:
+            out += '</g>'
+            return out
 
         if document._text_box:
             out += """<rect x="0"  y="0" width="%s" height="%s"
@@ -1531,3 +1611,31 @@ class group(beampy_module):
         out += '</g>'
 
         return out
+
+    def export_svg_shared_layers(self):
+        """
+        Split the svg of the layers of the group in the first contents
+        shared by all the layers and the other contents of each layer.
+
+        Return (shared_svg, {layer: overlay_svg}), drawing overlay_svg
+        over shared_svg gives the svg of the layer. shared_svg is None
+        when layers do not start with the same contents.
+        """
+
+        layers = [layer for layer in self.layers if layer in self.content_layer]
+        if len(layers) < 2:
+            return None, {}
+
+        nshared = 0
+        for contents in zip(*[self.content_layer[layer] for layer in layers]):
+            if any(content != contents[0] for content in contents[1:]):
+                break
+            nshared += 1
+
+        if nshared == 0:
+            return None, {}
+
+        shared_svg = self.export_svg_layer(layers[0], 0, nshared)
+        overlays_svg = dict((layer, self.export_svg_layer(layer, nshared)) for layer in layers)
+
+        return shared_svg, overlays_svg
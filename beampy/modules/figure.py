@@ -7,15 +7,15 @@ Created on Sun Oct 25 19:05:18 2015
 
 from beampy import document
 from beampy.functions import (convert_unit, optimize_svg, gcs,
-                              make_global_svg_defs, getsvgwidth,
+                              remap_svg_ids, split_svg_root, getsvgwidth,
                               getsvgheight, convert_pdf_to_svg,
                               convert_eps_to_svg,
-                              guess_file_type)
+                              guess_file_type, file_digest)
 
 from beampy.modules.core import beampy_module
 from bs4 import BeautifulSoup
 from PIL import Image
-from io import BytesIO, StringIO
+from io import BytesIO
 import hashlib
 import base64
 import tempfile
@@ -47,7 +47,8 @@ class figure(beampy_module):
     ext : {'svg','jpeg','png','pdf', 'gif', 'bokeh','matplotlib'} or None, optional 
        Image format defined as string (the default value is None,
        which implies that the image format is guessed from file or
-       python object name.
+       python object name. For a matplotlib figure, 'png' renders the
+       figure as a raster image.
 
     x : int or float or {'center', 'auto'} or str, optional
         Horizontal position for the figure (the default is 'center').
@@ -64,6 +65,14 @@ class figure(beampy_module):
         Height of the figure (the default is None, which implies that the width
         is width of the image).
 
+    rasterize_threshold : int or None, optional
+        Maximum number of drawn svg elements (lines, markers and paths)
+        of a matplotlib figure kept as vector graphics (the default theme
+        value is 5000). Above it, the heaviest artists of the figure (like
+        large scatter plots) are rasterized while axes and texts stay vector.
+        A line without markers counts as one element. None disables the
+        rasterization.
+
     """
 
     def __init__(self, content, ext=None, **kwargs):
@@ -79,6 +88,7 @@ class figure(beampy_module):
 
         # Special args for cache id
         self.args_for_cache_id = ['width', 'ext']
+        self.cache_deps = ['theme', 'optimize', 'resize_raster']
 
         # Check if the given filename is a string
         if isinstance(self.content, str):
@@ -93,6 +103,12 @@ class figure(beampy_module):
 
             # Mathplotlib figure
             if "matplotlib" in str(type(self.content)):
+                # Render the figure to png instead of svg
+                if self.ext == 'png':
+                    self.mpl_format = 'png'
+                else:
+                    self.mpl_format = 'svg'
+
                 self.ext = "matplotlib"
 
         ######################################
@@ -103,6 +119,17 @@ class figure(beampy_module):
             print("figure format can't be guessed.")
             sys.exit(1)
 
+        # External tools used to convert the figure to svg, the render
+        # waits for them and could run in a thread
+        if self.ext == 'pdf':
+            self.cache_deps = self.cache_deps + ['tool:pdf2svg']
+            self.threaded_render = True
+        if self.ext == 'eps':
+            self.cache_deps = self.cache_deps + ['tool:epstopdf', 'tool:pdf2svg']
+            self.threaded_render = True
+        if self.ext == 'svg' and svg_size_needs_inkscape(self.content):
+            self.threaded_render = True
+
         # Bokeh image
         if self.ext == 'bokeh':
             self.type = 'html'
@@ -130,27 +157,36 @@ class figure(beampy_module):
 
             # Create a special args to create a unique id for caching
 
-            # Generate the figure (in binary format as jpg) from the canvas
-            with BytesIO() as tmpb:
-                self.content.canvas.print_jpg(tmpb)
-                tmpb.seek(0)
-                md5t = hashlib.md5( tmpb.read() ).hexdigest()
-                #print(md5t)
+            # Draw the figure with an Agg canvas and hash its pixels
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            canvas = self.content.canvas
+            if isinstance(canvas, FigureCanvasAgg):
+                canvas.draw()
+                md5t = hashlib.md5(bytes(canvas.buffer_rgba())).hexdigest()
+            else:
+                # A new canvas replaces the one of the figure, which
+                # is restored after the hash
+                try:
+                    agg_canvas = FigureCanvasAgg(self.content)
+                    agg_canvas.draw()
+                    md5t = hashlib.md5(bytes(agg_canvas.buffer_rgba())).hexdigest()
+                finally:
+                    self.content.set_canvas(canvas)
 
             # Add this new arg
             self.args['mpl_fig_hash'] = md5t
             self.mpl_fig_hash = md5t
-            self.args_for_cache_id += ['mpl_fig_hash']
+            self.args_for_cache_id += ['mpl_fig_hash', 'mpl_format', 'rasterize_threshold']
 
             
         # Other filetype images
         if self.ext not in ('matplotlib', 'bokeh'):
 
-            # Add file timestamp to an arguments for caching
-            fdate = str(os.path.getmtime( self.content ))
-            self.args['filedate'] = fdate
-            self.filedate = fdate
-            self.args_for_cache_id += ['filedate']
+            # Add file content digest to an arguments for caching
+            fdigest = file_digest(self.content)
+            self.args['filedigest'] = fdigest
+            self.filedigest = fdigest
+            self.args_for_cache_id += ['filedigest']
 
             if self.width is None and self.height is None:
                 self.width = document._slides[gcs()].curwidth
@@ -164,8 +200,15 @@ class figure(beampy_module):
         """
 
 
+        # Matplotlib figure rendered as a raster image
+        if self.ext == 'matplotlib' and self.mpl_format == 'png':
+            self.render_matplotlib_png()
+
         # Svg // pdf render
-        if self.ext in ('svg', 'pdf', 'eps', 'matplotlib') :
+        elif self.ext in ('svg', 'pdf', 'eps', 'matplotlib') :
+            # Matplotlib artists rasterized at the resolution of the slide
+            rasterized = []
+
             #Convert pdf to svg
             if self.ext == 'pdf' :
                 figurein = convert_pdf_to_svg( self.content )
@@ -175,13 +218,23 @@ class figure(beampy_module):
             #Convert matplotlib figure to svg
             elif self.ext == 'matplotlib':
 
-                #Store mpl svg to a stringIO object
-                with StringIO() as tmpf:
-                    self.content.savefig(tmpf, bbox_inches='tight', format='svg')
-                    tmpf.seek(0) #go to the biginig of the file
-
-                    #store tmpf content as string in figurein variable
-                    figurein = tmpf.read().encode('utf-8')
+                #Rasterize the heaviest artists of huge figures
+                rasterized = rasterize_heavy_artists(self.content, self.rasterize_threshold)
+                if rasterized:
+                    savefig_args = {'dpi': self.mpl_dpi()}
+                else:
+                    savefig_args = {}
+
+                #Get the svg of the figure from matplotlib in memory
+                try:
+                    with BytesIO() as tmpf:
+                        self.content.savefig(tmpf, bbox_inches='tight', format='svg',
+                                             **savefig_args)
+                        figurein = tmpf.getvalue().decode('utf-8')
+                finally:
+                    #Restore the figure of the user
+                    for artist in rasterized:
+                        artist.set_rasterized(False)
 
             #General case for svg format
             else:
@@ -197,41 +250,25 @@ class figure(beampy_module):
             if document._optimize_svg:
                 figurein = optimize_svg(figurein)
 
-            soup = BeautifulSoup(figurein, 'xml')
+            #Prefix svg ids with the module id to make them unique in slides
+            figurein = remap_svg_ids(figurein, 'bp%s_' % self.id[:10])
 
-            #Change id in svg defs to use the global id system
-            soup = make_global_svg_defs(soup)
+            #Read the svg size and content without parsing the svg, when
+            #embeded images do not need to be resized (images of rasterized
+            #artists are already at the resolution of the slide)
+            svg_root = None
+            if not (document._resize_raster and '<image' in figurein) or rasterized:
+                svg_root = split_svg_root(figurein)
 
-            #Optimize the size of embeded svg images !
-            if document._resize_raster:
-                imgs = soup.findAll('image')
-                if imgs:
-                    for img in imgs:
-
-                        #True width and height of embed svg image
-                        width, height = int( float(img['width']) ) , int( float(img['height']) )
-                        img_ratio = height/float(width)
-                        b64content = img['xlink:href']
-
-                        try:
-                            in_img =  BytesIO( base64.b64decode(b64content.split(';base64,')[1]) )
-                            tmp_img = Image.open(in_img)
-                            #print(tmp_img)
-                            out_img = resize_raster_image( tmp_img, max_width=self.positionner.width.value )
-                            out_b64 = base64.b64encode( out_img.read() ).decode('utf8')
-
-                            #replace the resized image into the svg
-                            img['xlink:href'] = 'data:image/%s;base64, %s'%(tmp_img.format.lower(), out_b64)
-                        except:
-                            print('Unable to reduce the image size')
-                            pass
-
-            svgtag = soup.find('svg')
-
-            svg_viewbox = svgtag.get("viewBox")
-
-            tmph = svgtag.get("height")
-            tmpw = svgtag.get("width")
+            if svg_root is not None:
+                svg_attrs, tmpfig = svg_root
+            else:
+                svg_attrs, tmpfig = self.parse_svg(figurein)
+
+            svg_viewbox = svg_attrs.get("viewBox")
+
+            tmph = svg_attrs.get("height")
+            tmpw = svg_attrs.get("width")
             if tmph is None or tmpw is None:
                 with tempfile.NamedTemporaryFile(mode='w', prefix='beampytmp', suffix='.svg') as f:
                     try:
@@ -254,10 +291,6 @@ class figure(beampy_module):
                 svgheight = svg_viewbox.split(' ')[3]
                 svgwidth = svg_viewbox.split(' ')[2]
 
-
-            # BS4 get the svg tag content without <svg> and </svg>
-            tmpfig = svgtag.renderContents().decode('utf8')
-
             # Scale the figure according to the given width
             if self.width.value is not None and self.height.value is None:
                 # SCALE OK need to keep the original viewBox !!!
@@ -374,6 +407,162 @@ class figure(beampy_module):
         #Update the rendered state of the module
         self.rendered = True
 
+    def parse_svg(self, figurein):
+        """
+        Parse the svg with BeautifulSoup to resize its embeded images.
+        Return the attributes of the svg tag and its content.
+        """
+
+        soup = BeautifulSoup(figurein, 'xml')
+
+        #Optimize the size of embeded svg images !
+        if document._resize_raster:
+            imgs = soup.findAll('image')
+            if imgs:
+                for img in imgs:
+
+                    #True width and height of embed svg image
+                    width, height = int( float(img['width']) ) , int( float(img['height']) )
+                    img_ratio = height/float(width)
+                    b64content = img['xlink:href']
+
+                    try:
+                        in_img =  BytesIO( base64.b64decode(b64content.split(';base64,')[1]) )
+                        tmp_img = Image.open(in_img)
+                        #print(tmp_img)
+                        out_img = resize_raster_image( tmp_img, max_width=self.positionner.width.value )
+                        out_b64 = base64.b64encode( out_img.read() ).decode('utf8')
+
+                        #replace the resized image into the svg
+                        img['xlink:href'] = 'data:image/%s;base64, %s'%(tmp_img.format.lower(), out_b64)
+                    except:
+                        print('Unable to reduce the image size')
+                        pass
+
+        svgtag = soup.find('svg')
+
+        # BS4 get the svg tag content without <svg> and </svg>
+        return svgtag.attrs, svgtag.renderContents().decode('utf8')
+
+    def render_matplotlib_png(self):
+        """
+        Render the matplotlib figure to a png image with the Agg canvas
+        of matplotlib (the figure is never converted to svg).
+        """
+
+        with BytesIO() as tmpb:
+            self.content.savefig(tmpb, bbox_inches='tight', format='png', dpi=self.mpl_dpi())
+            png = tmpb.getvalue()
+
+        tmp_img = Image.open(BytesIO(png))
+        tmpwidth, tmpheight = tmp_img.size
+        tmp_img.close()
+        figurein = base64.b64encode(png).decode('utf8')
+
+        # Scale the image to the size of the figure in the slide
+        if self.width.value is not None and self.height.value is None:
+            figure_width = self.positionner.width.value
+            figure_height = figure_width * tmpheight / float(tmpwidth)
+        elif self.height.value is not None and self.width.value is None:
+            figure_height = self.positionner.height.value
+            figure_width = figure_height * tmpwidth / float(tmpheight)
+        else:
+            figure_height = self.positionner.height.value
+            figure_width = self.positionner.width.value
+
+        self.update_size(figure_width, figure_height)
+        self.svgout = '<image x="0" y="0" width="%s" height="%s" xlink:href="data:image/png;base64, %s" />'%(figure_width,
+                                                                                                            figure_height,
+                                                                                                            figurein)
+
+    def mpl_dpi(self):
+        """
+        Resolution used for the raster images of the matplotlib figure, it
+        gives an image twice larger than the figure in the slide (for high
+        density screens).
+        """
+
+        width_inch, height_inch = self.content.get_size_inches()
+
+        if self.width.value is not None:
+            return MPL_PNG_SCALE * self.positionner.width.value / width_inch
+
+        return MPL_PNG_SCALE * self.positionner.height.value / height_inch
+
+
+def svg_size_needs_inkscape(svg):
+    """
+    Check if the size of the svg (a file or its content) is not given by
+    the width and height of its root tag and must be computed by inkscape.
+    """
+
+    if os.path.isfile(svg):
+        with open(svg, 'r') as f:
+            svg = f.read()
+
+    svg_root = split_svg_root(svg)
+    if svg_root is None:
+        return True
+
+    return 'width' not in svg_root[0] or 'height' not in svg_root[0]
+
+
+def rasterize_heavy_artists(mpl_fig, threshold):
+    """
+    Rasterize the heaviest artists (collections and lines) of a matplotlib
+    figure until the number of elements left as svg is below the
+    threshold. Axes and texts are kept as svg. Return the list of
+    rasterized artists.
+    """
+
+    if threshold is None:
+        return []
+
+    artists = []
+    for ax in mpl_fig.get_axes():
+        for artist in list(ax.collections) + list(ax.lines):
+            if artist.get_visible() and not artist.get_rasterized():
+                artists.append((count_mpl_elements(artist), artist))
+
+    total = sum(n for n, _ in artists)
+    rasterized = []
+    for n, artist in sorted(artists, key=lambda a: a[0], reverse=True):
+        if total <= threshold:
+            break
+
+        artist.set_rasterized(True)
+        rasterized.append(artist)
+        total -= n
+
+    if rasterized:
+        print('Rasterize %i heavy artists of the matplotlib figure' % len(rasterized))
+
+    return rasterized
+
+
+def count_mpl_elements(artist):
+    """
+    Estimate the number of svg elements drawn for a matplotlib collection
+    or line.
+    """
+
+    # Line2D: a single path and a <use> for each marker
+    if hasattr(artist, 'get_xydata'):
+        if artist.get_marker() in (None, 'None', 'none', '', ' '):
+            return 1
+        return 1 + len(artist.get_xydata())
+
+    # Collection: a path for each offset (scatter) or each path
+    return max(len(artist.get_offsets()), len(artist.get_paths()))
+
+
+# Resolution of matplotlib figures rendered to png, relative to their
+# size in the slide
+MPL_PNG_SCALE = 2
+
+# Filter used to resize images (ANTIALIAS is removed from Pillow 10)
+RESIZE_FILTER = getattr(Image, 'LANCZOS', getattr(Image, 'ANTIALIAS', None))
+
 
 def resize_raster_image(PILImage, max_width=document._width, jpegqual=96):
     """
@@ -386,7 +575,7 @@ def resize_raster_image(PILImage, max_width=document._width, jpegqual=96):
         print('Image resized from (%ix%i)px to (%ix%i)px'%(img_w, img_h, max_width, max_width*img_ratio))
         width = int(max_width)
         height = int(max_width * img_ratio)
-        tmp_resized = PILImage.resize((width, height), Image.ANTIALIAS )
+        tmp_resized = PILImage.resize((width, height), RESIZE_FILTER)
     else:
         tmp_resized = PILImage
 
@@ -9,16 +9,26 @@ Class to manage text for beampy
 from beampy import document
 from beampy.functions import (gcs, color_text, getsvgwidth,
                               getsvgheight, small_comment_parser,
-                              latex2svg)
+                              latex2svg, glyph_id, text_render_key)
 
 from beampy.modules.core import beampy_module
 import tempfile
 import os
 
-from bs4 import BeautifulSoup
+from lxml import etree
+from xml.sax.saxutils import quoteattr
 import sys
 import hashlib
 import logging
+import time
+
+SVG_NS = '{http://www.w3.org/2000/svg}'
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+
+# Marks in parsed latex svg replaced by render
+LINK_STYLE_MARK = '__BEAMPY_LINK_STYLE__'
+TRANSFORM_MARK = '__BEAMPY_TRANSFORM__'
+OPACITY_MARK = '__BEAMPY_OPACITY__'
 
 class text(beampy_module):
     r"""
@@ -80,6 +90,10 @@ class text(beampy_module):
 
     """
 
+    # Key and duration of the latex render (used by the text render cache)
+    text_render_key = None
+    latex_time = 0
+
     def __init__(self, textin=None, **kwargs):
 
         self.type = 'text'
@@ -87,6 +101,7 @@ class text(beampy_module):
         self.content = textin
 
         self.svgtext = ''  # To store the svg produced by latex
+        self.latex_render = None  # To store the parsed svg of latex
 
         # Height of text is None (it need to be computed)
         self.height = None
@@ -98,6 +113,7 @@ class text(beampy_module):
         # Text need to be re-rendered from latex if with, color or size are changed
         self.initial_width = self.width
         self.args_for_cache_id = ['initial_width', 'color', 'size', 'align', 'opacity']
+        self.cache_deps = ['theme', 'latex_packages', 'tool:latex', 'tool:dvisvgm']
 
         # Initialise the global store on document._content to store letter
         if 'svg_glyphs' not in document._contents:
@@ -157,11 +173,14 @@ class text(beampy_module):
         else:
             self.latex_text = ''
 
-    def local_render(self):
+    def local_render(self, use_cache=True):
         """Function to render only on text of this module.
 
         It's slower than writing all texts to one latex file and then
         render it to dvi then svg.
+
+        When use_cache is True, the text render cache is checked first
+        and self.latex_render is loaded from it.
         """
 
         if self.latex_text != '':
@@ -201,11 +220,21 @@ class text(beampy_module):
 
 
             pretex += r'\begin{document}'
+
+            # The same text could have already been rendered
+            self.text_render_key = text_render_key(pretex, self.latex_text)
+            if use_cache and self.cache and document._cache is not None:
+                self.latex_render = document._cache.get_text_render(self.text_render_key)
+                if self.latex_render is not None:
+                    return
+
             pretex += self.latex_text
             pretex += r'\end{document}'
 
             #latex2svg
+            tlatex = time.time()
             self.svgtext = latex2svg( pretex )
+            self.latex_time = time.time() - tlatex
 
         else:
             self.svgtext = ''
@@ -218,69 +247,43 @@ class text(beampy_module):
 
         if self.usetex:
             #print(self.svgtext)
-            if self.svgtext == '':
-                # Run the local render
-                self.local_render()
-
-                # If it's still empty their is an error
+            if self.latex_render is None:
                 if self.svgtext == '':
-                    print("Latex Compilation Error")
-                    print("Beampy Input:")
-                    print(self.content)
-                    sys.exit(0)
+                    # Run the local render
+                    self.local_render()
+
+                    # If it's still empty their is an error
+                    if self.latex_render is None and self.svgtext == '':
+                        print("Latex Compilation Error")
+                        print("Beampy Input:")
+                        print(self.content)
+                        sys.exit(0)
+
+                if self.latex_render is None:
+                    self.latex_render = self.parse_latex_svg()
 
-            #Parse the ouput with beautifullsoup
-            soup = BeautifulSoup(self.svgtext, 'xml')
-            svgsoup = soup.find('svg')
-            #print(soup)
+                    # Store it in the text render cache
+                    if self.cache and document._cache is not None and self.text_render_key is not None:
+                        document._cache.add_text_render(self.text_render_key, self.latex_render,
+                                                        self.latex_time)
 
             #Find the width and height
-            xinit, yinit, text_width, text_height = svgsoup.get('viewBox').split()
+            xinit, yinit, text_width, text_height = self.latex_render['viewbox'].split()
             text_width = float(text_width)
             text_height = float(text_height)
 
-
-            #Get id of paths element to make a global counter over the entire document
-            if 'path' not in document._global_counter:
-                document._global_counter['path'] = 0
-
-            #New method with a global glyph store
-            svgsoup = self.parse_dvisvgm_svg( svgsoup )
-
-            #Change id in svg defs to use the global id system
-            #soup = make_global_svg_defs(soup)
-
-            #svgsoup = soup.find('svg')
-
-            #Find all links to apply the style defined in theme['link']
-            links = svgsoup.find_all('a')
+            #Apply to links the style defined in theme['link']
             style = ' '.join(['%s:%s;'%(str(key), str(value)) for key, value in list(document._theme['link'].items())])
-            for link in links:
-                link['style'] = style
+            output = self.latex_render['svg'].replace(LINK_STYLE_MARK, style)
 
-            #Use the first <use> in svg to get the y of the first letter
-            try:
-                uses = svgsoup.find_all('use')
-            except:
-                print(soup)
-
-            if len(uses) > 0:
+            #The y of the first letter (None if their is no <use> in svg)
+            baseline = self.latex_render['baseline']
+            if baseline is not None:
                 #TODO: need to make a more fine definition of baseline
-                baseline = 0
-                for use in uses:
-                    if use.has_attr('y'):
-                        baseline = float(use.get('y'))
-                        break
-
                 if baseline == 0:
                     print("No Baseline found in TeX and is put to 0")
                     #print baseline
 
-                #Get the group tag to get the transform matrix to add yoffset
-                g = svgsoup.find('g')
-                transform_matrix = g.get('transform')
-
-
                 if getattr(self, 'va', False) and self.va == 'baseline':
                     yoffset = - float(baseline)
                     xoffset = - float(xinit)
@@ -302,15 +305,13 @@ class text(beampy_module):
                 #newmatrix = 'translate(%s,%0.4f)'%(-float(xoffset),-float(yoffset) )
                 tex_pt_to_px = 96/72.27
                 newmatrix = 'scale(%0.3f) translate(%0.1f,%0.1f)'%(tex_pt_to_px, xoffset, yoffset)
-                g['transform'] = newmatrix
+                #Set the transform matrix of the group tag to add yoffset
+                output = output.replace(TRANSFORM_MARK, newmatrix)
                 text_width = text_width * tex_pt_to_px
                 text_height = text_height * tex_pt_to_px
                 baseline = baseline * tex_pt_to_px
                 yinit = yinit * tex_pt_to_px
-                g['opacity'] = self.opacity
-                #g['viewBox'] = svgsoup.get('viewBox')
-
-            output = svgsoup.renderContents().decode('utf8', errors='replace')
+                output = output.replace(OPACITY_MARK, str(self.opacity))
 
             #Add red box around the text
             if document._text_box:
@@ -363,87 +364,155 @@ class text(beampy_module):
 
 
 
-    def parse_dvisvgm_svg(self, soup_data):
+    def parse_latex_svg(self, retry=True):
+        """
+        Parse the svg produced by latex and dvisvgm (self.svgtext) and
+        move its glyphs to the global glyph store.
+
+        The svg is parsed with lxml and processed in one traversal:
+        references to glyphs are renamed to the global glyph ids, the
+        baseline is read from the first <use> and marks are added for
+        the style of links and the transform and opacity of the text
+        group (they are set by render).
+
+        return: dict with the parsed svg (without the defs part), its
+        viewbox and the baseline. This could be stored in the text
+        render cache as it does not depend on the position of the text.
+        """
+
+        root = etree.fromstring(self.svgtext.encode('utf-8'))
+        viewbox = root.get('viewBox')
+
+        #Get id of paths element to make a global counter over the entire document
+        if 'path' not in document._global_counter:
+            document._global_counter['path'] = 0
+
+        #New method with a global glyph store
+        id_map = self.parse_dvisvgm_svg(root)
+
+        baseline = None
+        has_uses = False
+        for elem in root.iter():
+            # Skip comments and processing instructions
+            if not isinstance(elem.tag, str):
+                continue
+
+            tag = etree.QName(elem).localname
+            if tag == 'a':
+                elem.set('style', LINK_STYLE_MARK)
+                continue
+
+            href = elem.get(XLINK_HREF)
+            if href is not None:
+                if href[1:] in id_map:
+                    #Change the dvisvgm ref to the new uniq_id ref of the glyph
+                    elem.set(XLINK_HREF, '#%s' % id_map[href[1:]])
+
+                elif '-' in href and retry:
+                    #Undefined reference (they could be defined in other page of the)
+                    print('A svg reference is not defined:')
+                    print(etree.tostring(elem))
+                    print('This is a bug in multipage of your dvisvgm version (bug fix in dvisvgm version > 2.7.2)')
+                    print('Run a single render for this text and parse it again! this should fix missings')
+                    self.local_render(use_cache=False)
+                    return self.parse_latex_svg(retry=False)
+
+            if tag == 'use':
+                has_uses = True
+                if baseline is None and elem.get('y') is not None:
+                    baseline = float(elem.get('y'))
+
+        if has_uses:
+            if baseline is None:
+                baseline = 0
+
+            #Get the group tag to set its transform matrix
+            g = next(root.iter(SVG_NS + 'g'))
+            g.set('transform', TRANSFORM_MARK)
+            g.set('opacity', OPACITY_MARK)
+
+        # Keep only the content of the <svg> tag (namespaces are
+        # declared on it)
+        svg = etree.tostring(root, encoding='unicode')
+        if svg.endswith('/>'):
+            svg = ''
+        else:
+            svg = svg[svg.index('>')+1:svg.rindex('</')]
+
+        return {'svg': svg, 'viewbox': viewbox, 'baseline': baseline}
+
+    def parse_dvisvgm_svg(self, svg_root):
         """
         Function to transform the svg produced by dvisvgm.
         Make a global glyph store to use them as defs in svg
         to reduce the size off the global presentation.
 
-        soup_data: BeautifulSoup parsed svg
+        svg_root: lxml root element of the svg (its defs are removed)
 
-        return: soup_data (without the defs part)
+        return: dict to rename dvisvgm glyphs ids to global glyph ids
         """
 
         #Check if their is an entry in the global_store for the glyphs
         if 'glyphs' not in document._global_store:
             document._global_store['glyphs'] = {}
 
+        id_map = {}
+
         #Extract defs containing glyphs from the svg file
-        try:
-            defs = soup_data.find_all('defs')[0].extract()
-            for path in defs.find_all('path'):
-                #store the id of the glyph given by dvisvgm
+        defs = svg_root.find(SVG_NS + 'defs')
+        if defs is None:
+            return id_map
+
+        svg_root.remove(defs)
+
+        #Theirs is also definition use in the defs
+        defs_uses = {}
+        for use in defs.iter(SVG_NS + 'use'):
+            defs_uses.setdefault(use.get(XLINK_HREF, '')[1:], []).append(use)
+
+        for path in defs.iter(SVG_NS + 'path'):
+            #store the id of the glyph given by dvisvgm
+            path_id = path.get('id')
+            #store the bezier coordinates of the glyph
+            path_d = path.get('d')
+            hash_id = hashlib.md5(path_d.encode('utf8')).hexdigest()
+
+            #check if the glyph is in the store or add it
+            if hash_id not in document._global_store['glyphs']:
+                #Add the glyph to the store with an id given by its path
+                uniq_id = glyph_id(path_d)
+                new_svg = "<path d='%s' id='%s'/>"%(path_d, uniq_id)
+                document._global_store['glyphs'][ hash_id ] = {"old_id": path_id, "d": path_d, "id": uniq_id, 'svg':new_svg}
 
-                path_id = path['id']
-                #store the bezier coordinates of the glyph
-                path_d = path['d']
-                try:
-                    hash_id = hashlib.md5(path_d).hexdigest()
-                except:
-                    hash_id = hashlib.md5(path_d.encode('utf8')).hexdigest()
+            else:
+                data_store = document._global_store['glyphs'][ hash_id ]
+                uniq_id = data_store['id']
 
+            id_map[path_id] = uniq_id
 
-                #print(hash_id, path_id)
+            for use in defs_uses.get(path_id, []):
+                #store the id of the glyph given by dvisvgm
+                u_id = use.attrib.pop('id', None)
+                #The id of the alias is given by its svg (without id)
+                use.set(XLINK_HREF, '#%s'%(uniq_id))
+                use_id = glyph_id(use_to_svg(use))
+                use.set('id', use_id)
+                document._global_store['glyphs'][ use_id ] = {"old_id": u_id,  "id": use_id, 'svg':use_to_svg(use)}
+                id_map[u_id] = use_id
 
-                #check if the glyph is in the store or add it
-                if hash_id not in document._global_store['glyphs']:
-                    #Add the glyph to the store and create a new uniq id for it
-                    uniq_id = "g_"+str(len(document._global_store['glyphs']))
-                    new_svg = "<path d='%s' id='%s'/>"%(path_d, uniq_id)
-                    document._global_store['glyphs'][ hash_id ] = {"old_id": path_id, "d": path_d, "id": uniq_id, 'svg':new_svg}
+        return id_map
 
 
-                else:
-                    data_store = document._global_store['glyphs'][ hash_id ]
-                    uniq_id = data_store['id']
+def use_to_svg(use):
+    """
+    Return the svg of a <use> lxml element (without namespace
+    declarations as it's added to the defs of the document)
+    """
 
-                #Find all the xlink:href to this glyph in the use part of the svg
-                for tag in soup_data.find_all('use', { 'xlink:href':'#%s'%(path_id) }):
-                    #Change the dvisvgm ref to the new uniq_id ref of the glyph
-                    tag['xlink:href'] = '#%s'%(uniq_id)
-
-
-                #Theirs is also definition use in the defs
-                for use in defs.find_all('use', {'xlink:href':'#%s'%(path_id)}):
-                    # print(use)
-                    #store the id of the glyph given by dvisvgm
-                    u_id = use['id']
-                    use_id = "g_"+str( len(document._global_store['glyphs']) )
-                    use['id'] = use_id
-                    use['xlink:href'] = '#%s'%(uniq_id)
-                    document._global_store['glyphs'][ use_id ] = {"old_id": u_id,  "id": use_id, 'svg':str(use)}
-                    # print(use, u_id, use_id)
-
-                    #Find all the xlink:href to this glyph in the use part of the svg
-                    for tag in soup_data.find_all('use', { 'xlink:href':'#%s'%(u_id) }):
-                        #Change the dvisvgm ref to the new uniq_id ref of the glyph
-                        tag['xlink:href'] = '#%s'%(use_id)
-
-        except:
-            defs = None
-            pass
-
-
-        #Need to check if we have undefined reference
-        #(they could be defined in other page of the)
-        # We need to exclude <a> tag as html links could include "-" in the xlink:href
-        for tag in soup_data.findAll(lambda x: x.name != 'a' and x is not None and x.has_attr('xlink:href')):
-            if '-' in tag['xlink:href']:
-                print('A svg reference is not defined:')
-                print(tag)
-                print('This is a bug in multipage of your dvisvgm version (bug fix in dvisvgm version > 2.7.2)')
-                print('Run a single render for this text and parse it again! this should fix missings')
-                self.local_render()
-                self.render()
-
-        return soup_data
+    attrs = []
+    for key, value in sorted(use.attrib.items()):
+        if key == XLINK_HREF:
+            key = 'xlink:href'
+        attrs += ['%s=%s' % (key, quoteattr(value))]
+
+    return '<use %s/>' % ' '.join(attrs)
@@ -66,6 +66,8 @@ class tikz(beampy_module):
 
         # Special args for cache id (when do we need to re-run latex render)
         self.args_for_cache_id = ['figure_options', 'tex_packages', 'tikz_header', 'latex_pre_tikzpicture']
+        self.cache_deps = ['theme', 'tool:latex', 'tool:dvisvgm']
+        self.threaded_render = True
 
         self.register()
 
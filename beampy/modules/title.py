@@ -25,11 +25,13 @@ class title( text ):
         self.content = titlein
 
         self.svgtext = ''  # To store the svg produced by latex
+        self.latex_render = None  # To store the parsed svg of latex
         
         #Add text arguments because we use the text render
         self.load_extra_args('text')
         #Re-compute the title when color or size is changed
         self.args_for_cache_id = ['color','size']
+        self.cache_deps = ['theme', 'latex_packages', 'tool:latex', 'tool:dvisvgm']
         
         if self.width == None:
             self.width = document._width
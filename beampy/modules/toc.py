@@ -125,6 +125,9 @@ class tableofcontents(group):
        0.2). Opacity is between 0 (fully hidden) to 1.
 
     """
+
+    # The TOC depends on the other slides of the presentation
+    incremental = False
     
     def __init__(self, sections=[], subsection=True,
                  subsubsection=True, currentsection=False,
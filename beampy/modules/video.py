@@ -8,6 +8,7 @@ Class to manage text for beampy
 """
 from beampy import document
 from beampy.modules.core import beampy_module, gcs
+from beampy.functions import file_digest
 import base64
 import os
 try:
@@ -92,11 +93,13 @@ class video(beampy_module):
 
         # Special args for cache id
         self.args_for_cache_id = ['width', 'still_image_time', 'embedded']
-        # Add the time stamp of the video file
-        fdate = str(os.path.getmtime( self.content ))
-        self.args['filedate'] = fdate
-        self.filedate = fdate
-        self.args_for_cache_id += ['filedate']
+        self.cache_deps = ['theme', 'tool:video_encoder']
+        self.threaded_render = True
+        # Add the content digest of the video file
+        fdigest = file_digest(self.content)
+        self.args['filedigest'] = fdigest
+        self.filedigest = fdigest
+        self.args_for_cache_id += ['filedigest']
 
         #Register the module
         self.register()
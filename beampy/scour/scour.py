@@ -63,11 +63,20 @@ from decimal import Context, Decimal, InvalidOperation, getcontext
 import six
 from six.moves import range, urllib
 
-from beampy.scour.svg_regex import svg_parser
+from beampy.scour.svg_regex import svg_parser, svg_float_parser
 from beampy.scour.svg_transform import svg_transform_parser
 from beampy.scour.yocto_css import parseCssString
 from beampy.scour import __version__
 
+# Numbers are rounded with floats instead of Decimal (float_precision option)
+scouringFloat = False
+
+# NumPy is optional, it is used to clean large path data (see fastCleanPath)
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 APP = u'scour'
 VER = __version__
@@ -404,6 +413,8 @@ def is_same_sign(a, b):
 def is_same_direction(x1, y1, x2, y2):
     if is_same_sign(x1, x2) and is_same_sign(y1, y2):
         diff = y1/x1 - y2/x2
+        if scouringFloat:
+            return float('%.*g' % (scouringContext.prec, 1 + diff)) == 1
         return scouringContext.plus(1 + diff) == 1
     else:
         return False
@@ -2058,6 +2069,41 @@ def convertColors(element):
 #       reusing data structures, etc
 
 
+# Significant digits kept by the relative coordinates of paths computed
+# with floats (see snapFloatPath)
+FLOAT_PATH_DIGITS = 12
+
+
+def pathScale(path):
+    """
+    Return the largest absolute value of the numbers of a parsed path
+    """
+    return max([0] + [abs(v) for cmd, data in path for v in data])
+
+
+def snapFloat(value, tolerance):
+    """
+    Round a coordinate computed with floats by cleanPath (float_precision
+    option). The float differences leave residues (like 2.1316e-14
+    instead of 0) where the Decimal arithmetic is exact: values below the
+    tolerance (the precision of the coordinates of the path, see
+    pathScale) are set to 0 and the others are rounded to
+    FLOAT_PATH_DIGITS digits.
+    """
+    if abs(value) <= tolerance:
+        return 0.0
+    return float('%.*g' % (FLOAT_PATH_DIGITS, value))
+
+
+def snapFloatPath(path, tolerance):
+    """
+    Round all the numbers of a path with snapFloat
+    """
+    for cmd, data in path:
+        for i in range(len(data)):
+            data[i] = snapFloat(data[i], tolerance)
+
+
 def cleanPath(element, options):
     """
        Cleans the path string (d attribute) of the element
@@ -2067,7 +2113,17 @@ def cleanPath(element, options):
 
     # this gets the parser object from svg_regex.py
     oldPathStr = element.getAttribute('d')
-    path = svg_parser.parse(oldPathStr)
+    if options.float_precision:
+        path = svg_float_parser.parse(oldPathStr)
+        tolerance = pathScale(path) * 10 ** -FLOAT_PATH_DIGITS
+
+        def snap(value):
+            return snapFloat(value, tolerance)
+    else:
+        path = svg_parser.parse(oldPathStr)
+
+        def snap(value):
+            return value
     style = _getStyle(element)
 
     # This determines whether the stroke has round or square linecaps.  If it does, we do not want to collapse empty
@@ -2192,6 +2248,9 @@ def cleanPath(element, options):
             x, y = startx, starty
             path[pathIndex] = ('z', data)
 
+    if options.float_precision:
+        snapFloatPath(path, tolerance)
+
     # remove empty segments and redundant commands
     # Reuse the data structure 'path' and the coordinate lists, even if we're
     # deleting items, because these deletions are relatively cheap.
@@ -2419,7 +2478,7 @@ def cleanPath(element, options):
             if len(newPath):
                 (prevCmd, prevData) = newPath[-1]
                 if prevCmd == 's':
-                    bez_ctl_pt = (prevData[-2] - prevData[-4], prevData[-1] - prevData[-3])
+                    bez_ctl_pt = (snap(prevData[-2] - prevData[-4]), snap(prevData[-1] - prevData[-3]))
             i = 0
             curveTuples = []
             while i < len(data):
@@ -2440,7 +2499,7 @@ def cleanPath(element, options):
                         j += 1
 
                 # set up control point for next curve segment
-                bez_ctl_pt = (data[i + 4] - data[i + 2], data[i + 5] - data[i + 3])
+                bez_ctl_pt = (snap(data[i + 4] - data[i + 2]), snap(data[i + 5] - data[i + 3]))
                 i += 6
 
             if curveTuples:
@@ -2464,7 +2523,7 @@ def cleanPath(element, options):
                         curveTuples.append(data[i + j])
                         j += 1
 
-                quad_ctl_pt = (data[i + 2] - data[i], data[i + 3] - data[i + 1])
+                quad_ctl_pt = (snap(data[i + 2] - data[i]), snap(data[i + 3] - data[i + 1]))
                 i += 4
 
             if curveTuples:
@@ -2555,6 +2614,101 @@ def cleanPath(element, options):
         element.setAttribute('d', newPathStr)
 
 
+# tokens of path data without arcs: a command or a number
+_path_tokens = re.compile(r'([MmZzLlHhVvCcSsQqTt])|([-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?)')
+_path_separators = re.compile(r'[\s,]*\Z')
+
+
+def fastCleanPath(element, options):
+    """
+       Cleans a large path string (d attribute) of the element in a batch:
+       the numbers are parsed to a NumPy array, formatted with the number
+       of significant digits and written back with the same commands.
+
+       Unlike cleanPath, segments are not converted or removed, so the
+       time only grows with the size of the path. It is used for paths
+       with more than options.fast_path_threshold numbers and without
+       arcs (their flags can be written without separators).
+
+       Returns True when the path has been cleaned.
+    """
+    global _num_bytes_saved_in_path_data
+
+    if numpy is None or options.fast_path_threshold <= 0:
+        return False
+
+    oldPathStr = element.getAttribute('d')
+    if len(oldPathStr) < options.fast_path_threshold or 'a' in oldPathStr or 'A' in oldPathStr:
+        return False
+
+    tokens = _path_tokens.findall(oldPathStr)
+    numbers = [num for cmd, num in tokens if num]
+    if len(numbers) < options.fast_path_threshold:
+        return False
+
+    # Only commands, numbers and separators are allowed
+    if _path_separators.match(_path_tokens.sub('', oldPathStr)) is None:
+        return False
+
+    values = numpy.array(numbers, dtype=float)
+    strings = numpy.char.mod('%%.%ig' % options.digits, values).tolist()
+    sciFormat = '%%.%ie' % (options.digits - 1)
+
+    newData = []
+    previousCoord = ''
+    previousCmd = ''
+    inumber = 0
+    for cmd, num in tokens:
+        if cmd:
+            # repeated commands are implicit (except moveto, which
+            # is followed by implicit linetos)
+            if cmd != previousCmd or cmd in 'MmZz':
+                newData.append(cmd)
+                previousCoord = ''
+                previousCmd = cmd
+            continue
+
+        scouredCoord = strings[inumber]
+        inumber += 1
+
+        # same number writing as scourUnitlessLength (the scientific
+        # notation is used when it's shorter)
+        if 'e' in scouredCoord:
+            mantissa, exponent = scouredCoord.split('e')
+            scouredCoord = mantissa + 'e' + str(int(exponent))
+        elif scouredCoord == '-0':
+            scouredCoord = '0'
+        elif '0.00' in scouredCoord or scouredCoord.endswith('000'):
+            mantissa, exponent = (sciFormat % values[inumber-1]).split('e')
+            if '.' in mantissa:
+                mantissa = mantissa.rstrip('0').rstrip('.')
+            sci = mantissa + 'e' + str(int(exponent))
+            if len(sci) < len(scouredCoord):
+                scouredCoord = sci
+
+        if not options.renderer_workaround:
+            if scouredCoord[:2] == '0.':
+                scouredCoord = scouredCoord[1:]
+            elif scouredCoord[:3] == '-0.':
+                scouredCoord = '-' + scouredCoord[2:]
+
+        # same separators as scourCoordinates
+        if previousCoord and (scouredCoord[0].isdigit()
+                              or (scouredCoord[0] == '.' and not ('.' in previousCoord or 'e' in previousCoord))
+                              or (options.renderer_workaround and scouredCoord[0] == '-' and 'e' in previousCoord)):
+            newData.append(' ')
+
+        newData.append(scouredCoord)
+        previousCoord = scouredCoord
+
+    newPathStr = ''.join(newData)
+    if len(newPathStr) <= len(oldPathStr):
+        _num_bytes_saved_in_path_data += (len(oldPathStr) - len(newPathStr))
+        element.setAttribute('d', newPathStr)
+
+    return True
+
+
 def parseListOfPoints(s):
     """
        Parse string into a list of points.
@@ -2758,6 +2912,9 @@ def scourUnitlessLength(length, renderer_workaround=False, is_control_point=Fals
     This is faster than scourLength on elements guaranteed not to
     contain units.
     """
+    if scouringFloat:
+        return scourUnitlessLengthFloat(length, renderer_workaround, is_control_point)
+
     if not isinstance(length, Decimal):
         length = getcontext().create_decimal(str(length))
     initial_length = length
@@ -2804,6 +2961,68 @@ def scourUnitlessLength(length, renderer_workaround=False, is_control_point=Fals
     return return_value
 
 
+def scourUnitlessLengthFloat(length, renderer_workaround=False, is_control_point=False):
+    """
+    Float version of scourUnitlessLength (float_precision option): the
+    number is rounded to the significant digits with the string
+    formatting of floats, no Decimal context is used. The last digit
+    could be rounded differently than with Decimal.
+    """
+    length = float(length)
+
+    # reduce numeric precision
+    if is_control_point:
+        digits = scouringContextC.prec
+    else:
+        digits = scouringContext.prec
+
+    # %g removes trailing zeroes, without exponent it's the
+    # non-scientific notation version of the coordinate
+    nonsci = '%.*g' % (digits, length)
+    mantissa = None
+    if 'e' in nonsci:
+        mantissa, exponent = ('%.*e' % (digits - 1, length)).split('e')
+        exponent = int(exponent)
+        if '.' in mantissa:
+            mantissa = mantissa.rstrip('0').rstrip('.')
+
+        # Use the decimals of the reduced number with the initial value
+        # (e.g. 123456.7 should become 123457, not 123460)
+        if '.' in mantissa:
+            decimals = len(mantissa.split('.')[1]) - exponent
+        else:
+            decimals = -exponent
+
+        nonsci = '%.*f' % (max(0, decimals), length)
+
+    if nonsci == '-0':
+        nonsci = '0'
+
+    if not renderer_workaround:
+        if len(nonsci) > 2 and nonsci[:2] == '0.':
+            nonsci = nonsci[1:]  # remove the 0, leave the dot
+        elif len(nonsci) > 3 and nonsci[:3] == '-0.':
+            nonsci = '-' + nonsci[2:]  # remove the 0, leave the minus and dot
+    return_value = nonsci
+
+    # Gather the scientific notation version of the coordinate which
+    # can only be shorter for large numbers ending with zeroes or
+    # small numbers starting with zeroes (e.g. 1000 = 1e3).
+    if len(nonsci) > 3 and (mantissa is not None or nonsci.endswith('00') or '.00' in nonsci):
+        if mantissa is None:
+            mantissa, exponent = ('%.*e' % (digits - 1, length)).split('e')
+            exponent = int(exponent)
+            if '.' in mantissa:
+                mantissa = mantissa.rstrip('0').rstrip('.')
+
+        sci = mantissa + 'e' + str(exponent)
+
+        if len(sci) < len(nonsci):
+            return_value = sci
+
+    return return_value
+
+
 def reducePrecision(element):
     """
     Because opacities, letter spacings, stroke widths and all that don't need
@@ -3402,8 +3621,10 @@ def scourString(in_string, options=None):
     # to minimize errors
     global scouringContext
     global scouringContextC  # even more reduced precision for control points
+    global scouringFloat  # round numbers with floats instead of Decimal
     scouringContext = Context(prec=options.digits)
     scouringContextC = Context(prec=options.cdigits)
+    scouringFloat = options.float_precision
 
     # globals for tracking statistics
     # TODO: get rid of these globals...
@@ -3597,7 +3818,7 @@ def scourString(in_string, options=None):
     for elem in doc.documentElement.getElementsByTagName('path'):
         if elem.getAttribute('d') == '':
             elem.parentNode.removeChild(elem)
-        else:
+        elif not fastCleanPath(elem, options):
             cleanPath(elem, options)
 
     # shorten ID names as much as possible
@@ -3738,6 +3959,15 @@ _option_group_optimization.add_option("--set-c-precision",
                                       action="store", type=int, dest="cdigits", default=-1, metavar="NUM",
                                       help="set number of significant digits for control points "
                                            "(default: same as '--set-precision')")
+_option_group_optimization.add_option("--float-precision",
+                                      action="store_true", dest="float_precision", default=False,
+                                      help="reduce the precision of numbers with floats instead of Decimal "
+                                           "(faster, the last digit could differ)")
+_option_group_optimization.add_option("--fast-path-threshold",
+                                      action="store", type=int, dest="fast_path_threshold", default=0,
+                                      metavar="NUM",
+                                      help="only reduce the precision of path data with more than NUM numbers, "
+                                           "in a single pass with NumPy (default: %default, disabled)")
 _option_group_optimization.add_option("--disable-simplify-colors",
                                       action="store_false", dest="simple_colors", default=True,
                                       help="won't convert colors to #RRGGBB format")
@@ -120,11 +120,21 @@ class SVGPathParser(object):
 
     The main method is `parse(text)`. It can only consume actual strings, not
     filelike objects or iterators.
+
+    Numbers are Decimal objects (in the current Decimal context), unless
+    an other `number_type` (like float) is given.
     """
 
-    def __init__(self, lexer=svg_lexer):
+    def __init__(self, lexer=svg_lexer, number_type=None):
         self.lexer = lexer
 
+        if number_type is None:
+            self.create_number = lambda text: getcontext().create_decimal(text)
+            self.create_arc_number = lambda text: Decimal(text) * 1
+        else:
+            self.create_number = number_type
+            self.create_arc_number = number_type
+
         self.command_dispatch = {
             'Z': self.rule_closepath,
             'z': self.rule_closepath,
@@ -230,26 +240,26 @@ class SVGPathParser(object):
         token = next_val_fn()
         arguments = []
         while token[0] in self.number_tokens:
-            rx = Decimal(token[1]) * 1
+            rx = self.create_arc_number(token[1])
             if rx < Decimal("0.0"):
                 raise SyntaxError("expecting a nonnegative number; got %r" % (token,))
 
             token = next_val_fn()
             if token[0] not in self.number_tokens:
                 raise SyntaxError("expecting a number; got %r" % (token,))
-            ry = Decimal(token[1]) * 1
+            ry = self.create_arc_number(token[1])
             if ry < Decimal("0.0"):
                 raise SyntaxError("expecting a nonnegative number; got %r" % (token,))
 
             token = next_val_fn()
             if token[0] not in self.number_tokens:
                 raise SyntaxError("expecting a number; got %r" % (token,))
-            axis_rotation = Decimal(token[1]) * 1
+            axis_rotation = self.create_arc_number(token[1])
 
             token = next_val_fn()
             if token[1][0] not in ('0', '1'):
                 raise SyntaxError("expecting a boolean flag; got %r" % (token,))
-            large_arc_flag = Decimal(token[1][0]) * 1
+            large_arc_flag = self.create_arc_number(token[1][0])
 
             if len(token[1]) > 1:
                 token = list(token)
@@ -258,7 +268,7 @@ class SVGPathParser(object):
                 token = next_val_fn()
             if token[1][0] not in ('0', '1'):
                 raise SyntaxError("expecting a boolean flag; got %r" % (token,))
-            sweep_flag = Decimal(token[1][0]) * 1
+            sweep_flag = self.create_arc_number(token[1][0])
 
             if len(token[1]) > 1:
                 token = list(token)
@@ -267,12 +277,12 @@ class SVGPathParser(object):
                 token = next_val_fn()
             if token[0] not in self.number_tokens:
                 raise SyntaxError("expecting a number; got %r" % (token,))
-            x = Decimal(token[1]) * 1
+            x = self.create_arc_number(token[1])
 
             token = next_val_fn()
             if token[0] not in self.number_tokens:
                 raise SyntaxError("expecting a number; got %r" % (token,))
-            y = Decimal(token[1]) * 1
+            y = self.create_arc_number(token[1])
 
             token = next_val_fn()
             arguments.extend([rx, ry, axis_rotation, large_arc_flag, sweep_flag, x, y])
@@ -282,7 +292,7 @@ class SVGPathParser(object):
     def rule_coordinate(self, next_val_fn, token):
         if token[0] not in self.number_tokens:
             raise SyntaxError("expecting a number; got %r" % (token,))
-        x = getcontext().create_decimal(token[1])
+        x = self.create_number(token[1])
         token = next_val_fn()
         return x, token
 
@@ -290,13 +300,15 @@ class SVGPathParser(object):
         # Inline these since this rule is so common.
         if token[0] not in self.number_tokens:
             raise SyntaxError("expecting a number; got %r" % (token,))
-        x = getcontext().create_decimal(token[1])
+        x = self.create_number(token[1])
         token = next_val_fn()
         if token[0] not in self.number_tokens:
             raise SyntaxError("expecting a number; got %r" % (token,))
-        y = getcontext().create_decimal(token[1])
+        y = self.create_number(token[1])
         token = next_val_fn()
         return [x, y], token
 
 
 svg_parser = SVGPathParser()
+# Parser with float numbers (for the float_precision option of scour)
+svg_float_parser = SVGPathParser(number_type=float)
@@ -13,6 +13,12 @@ THEME['document'] = {
     'optimize': True,
     'resize_raster':True,
     'cache': True,
+    'shared_cache': None, # Path to a cache folder shared between documents (like '~/.cache/beampy')
+    'cache_max_size': None, # Maximum size of cache files in bytes (None for no limit)
+    'cache_max_entries': None, # Maximum number of cached elements (None for no limit)
+    'latex_jobs': 'auto', # Number of latex processes to render texts ('auto' for the number of cpus)
+    'render_threads': 'auto', # Number of threads to render modules using external tools ('auto' for the number of cpus)
+    'pdf_shared_layers': False, # Draw the contents shared by the layers of a slide once in pdf (needs pikepdf)
     'guide': False,
     'text_box': False,
     'html': {
@@ -134,7 +140,12 @@ THEME['figure'] = {
     'x':'center',
     'y':'auto',
     'width':None,
-    'height':None
+    'height':None,
+    # Maximum number of drawn svg elements (lines, markers, paths) kept
+    # as svg for a matplotlib figure, the heaviest artists are rasterized
+    # above it (None to disable). Matplotlib figures above this default
+    # are rendered differently than with previous beampy versions
+    'rasterize_threshold': 5000
 }
 
 THEME['cite'] = {
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Watch mode of beampy: rebuild a presentation script when it (or a file
+used by its slides) changes and serve the html output with a live
+reload of the browser.
+
+Usage:
+
+    beampy watch my_presentation.py [--port 8000]
+"""
+
+import os
+import sys
+import time
+import runpy
+import argparse
+import threading
+import traceback
+import webbrowser
+
+try:
+    from http.server import SimpleHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    # Python 2
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from beampy.document import document
+
+import logging
+_log = logging.getLogger(__name__)
+
+
+class script_builder(object):
+    """
+    Run a presentation script in the current python process (so modules,
+    external programs and the cache stay loaded between builds) and
+    find the files it depends on.
+    """
+
+    def __init__(self, script):
+        self.script = os.path.abspath(script)
+        self.mtimes = {}
+        self.output = None
+        self.build_count = 0
+        self.build_cond = threading.Condition()
+
+    def run(self):
+        """
+        Run the script, errors are printed and the watch continues.
+        """
+
+        tstart = time.time()
+
+        # The script is run as if it was called by python
+        sys.argv = [self.script]
+        # beampy.document is shadowed by the document class in beampy
+        sys.modules['beampy.document'].script_file_name = os.path.basename(self.script).split('.')[0]
+        document._keep_cache = True
+        document._output_file = None
+
+        try:
+            runpy.run_path(self.script, run_name='__main__')
+        except KeyboardInterrupt:
+            raise
+        except BaseException:
+            traceback.print_exc()
+            print('Build failed, waiting for changes')
+
+        if document._output_file is not None:
+            self.output = os.path.abspath(document._output_file)
+
+        self.mtimes = self.get_mtimes(self.watched_files())
+        print('Build done in %0.3f seconds' % (time.time() - tstart))
+
+        with self.build_cond:
+            self.build_count += 1
+            self.build_cond.notify_all()
+
+    def watched_files(self):
+        """
+        Return the script and the files used as content by the modules
+        (figures, videos, svg files...).
+        """
+
+        files = set([self.script])
+        for slide in document._slides.values():
+            for module in slide.contents.values():
+                content = module.content
+                if isinstance(content, str) and len(content) < 4096 and os.path.isfile(content):
+                    files.add(os.path.abspath(content))
+
+        return files
+
+    def get_mtimes(self, files):
+        mtimes = {}
+        for f in files:
+            try:
+                mtimes[f] = os.path.getmtime(f)
+            except OSError:
+                mtimes[f] = None
+
+        return mtimes
+
+    def changed(self):
+        """
+        Check if one of the watched files has changed since the last build
+        """
+
+        return self.get_mtimes(self.mtimes) != self.mtimes
+
+    def wait_build(self, build_count, timeout):
+        """
+        Wait for a build after build_count, return the current build count
+        """
+
+        with self.build_cond:
+            if self.build_count == build_count:
+                self.build_cond.wait(timeout)
+
+            return self.build_count
+
+
+class watch_server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_handler(builder):
+    """
+    Create the http request handler class serving the folder of the
+    presentation and the reload events of the builder.
+    """
+
+    class watch_handler(SimpleHTTPRequestHandler):
+
+        def translate_path(self, path):
+            # Serve files from the folder of the output file
+            path = SimpleHTTPRequestHandler.translate_path(self, path)
+            relpath = os.path.relpath(path, os.getcwd())
+            return os.path.join(os.path.dirname(builder.output or builder.script), relpath)
+
+        def do_GET(self):
+            if self.path.startswith('/__beampy_events'):
+                return self.send_events()
+
+            return SimpleHTTPRequestHandler.do_GET(self)
+
+        def send_events(self):
+            # Server-sent events: send "reload" after each build which
+            # ends after the connection
+            build_count = builder.build_count
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            try:
+                while True:
+                    new_count = builder.wait_build(build_count, 15)
+                    if new_count != build_count:
+                        build_count = new_count
+                        self.wfile.write(b'data: reload\n\n')
+                    else:
+                        # Keep the connection alive
+                        self.wfile.write(b': ping\n\n')
+                    self.wfile.flush()
+            except (IOError, OSError):
+                pass
+
+        def end_headers(self):
+            self.send_header('Cache-Control', 'no-store')
+            SimpleHTTPRequestHandler.end_headers(self)
+
+        def log_message(self, format, *args):
+            _log.debug(format % args)
+
+    return watch_handler
+
+
+def watch(script, host='localhost', port=8000, interval=0.3, open_browser=True):
+    """
+    Build the presentation script and rebuild it each time it changes.
+    The html output is served on http://host:port with a live reload.
+    """
+
+    # Run the script from its folder, like "python script.py" would be
+    script = os.path.abspath(script)
+    os.chdir(os.path.dirname(script))
+
+    builder = script_builder(script)
+    builder.run()
+
+    server = watch_server((host, port), make_handler(builder))
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    if builder.output is not None:
+        url = 'http://%s:%i/%s?watch=1' % (host, port, os.path.basename(builder.output))
+    else:
+        url = 'http://%s:%i/' % (host, port)
+
+    print('Serving %s (Ctrl-C to stop)' % url)
+    if open_browser:
+        webbrowser.open(url)
+
+    try:
+        while True:
+            time.sleep(interval)
+            if builder.changed():
+                print('Change detected, rebuild %s' % builder.script)
+                builder.run()
+    except KeyboardInterrupt:
+        print('Stop watching')
+    finally:
+        server.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='beampy', description='Beampy presentation tools')
+    subparsers = parser.add_subparsers(dest='command')
+
+    watch_parser = subparsers.add_parser('watch', help='Rebuild a presentation when it changes and '
+                                                       'serve it with a live reload')
+    watch_parser.add_argument('script', help='The python script of the presentation')
+    watch_parser.add_argument('--host', default='localhost')
+    watch_parser.add_argument('--port', type=int, default=8000)
+    watch_parser.add_argument('--no-browser', action='store_true',
+                              help='Do not open the presentation in a web browser')
+
+    args = parser.parse_args(argv)
+    if args.command == 'watch':
+        watch(args.script, host=args.host, port=args.port,
+              open_browser=not args.no_browser)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
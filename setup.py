@@ -18,6 +18,9 @@ setup(
                                     'doc-src', '*.pyc']),
     include_package_data=True,
     zip_safe=False,
+    entry_points={
+        'console_scripts': ['beampy = beampy.watch:main']
+    },
     install_requires=[
         "beautifulsoup4",
         "pillow",
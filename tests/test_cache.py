@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Test the content addressed store used by the beampy cache
+"""
+import os
+from beampy.cache import cache_store
+
+
+def test_store_blobs(tmpdir):
+    store = cache_store(str(tmpdir))
+
+    digest = store.put_blob(u'<g>some svg</g>')
+    assert store.put_blob(b'<g>some svg</g>') == digest
+    assert store.get_blob(digest) == b'<g>some svg</g>'
+    assert os.path.exists(store.blob_path(digest))
+
+
+def test_store_index_is_append_only(tmpdir):
+    store = cache_store(str(tmpdir))
+    store.set('a', {'width': 10, 'blobs': {'svgout': store.put_blob('a')}})
+    store.set('b', {'width': 20})
+    store.flush()
+    store.set('b', {'width': 30})
+    store.remove('a')
+    store.flush()
+
+    with open(store.index_file) as f:
+        assert len(f.readlines()) == 4
+
+    store = cache_store(str(tmpdir))
+    assert 'a' not in store
+    assert store.get('b')['width'] == 30
+
+
+def test_store_gc(tmpdir):
+    store = cache_store(str(tmpdir))
+    used = store.put_blob('used')
+    orphan = store.put_blob('orphan')
+    store.set('a', {'blobs': {'svgout': used}})
+    store.flush()
+
+    assert store.gc() == 1
+    assert store.has_blob(used)
+    assert not store.has_blob(orphan)
+
+
+def test_shared_store_refresh(tmpdir):
+    store1 = cache_store(str(tmpdir), shared=True)
+    store2 = cache_store(str(tmpdir), shared=True)
+
+    store1.set('a', {'blobs': {'svgout': store1.put_blob('a')}})
+    store1.flush()
+    assert 'a' not in store2
+
+    store2.refresh()
+    assert 'a' in store2
+
+    # A compaction by an other process forces a full reload
+    store1.compact()
+    store1.set('b', {'width': 1})
+    store1.flush()
+    store2.refresh()
+    assert 'a' in store2 and 'b' in store2
+
+
+def test_glyphs_subset_and_merge():
+    from beampy.document import document
+    from beampy.functions import get_glyphs_subset, merge_glyphs
+
+    glyphs = {'h0': {'id': 'g_0', 'svg': "<path d='M0' id='g_0'/>"},
+              'h1': {'id': 'g_1', 'svg': "<path d='M1' id='g_1'/>"},
+              'g_2': {'id': 'g_2', 'svg': '<use id="g_2" xlink:href="#g_1"/>'}}
+
+    subset = get_glyphs_subset('<use xlink:href="#g_2"/>', glyphs)
+    assert sorted(subset) == ['g_2', 'h1']
+
+    document._global_store = {'glyphs': {'h0': glyphs['h0']}}
+    assert merge_glyphs(subset)
+    assert sorted(document._global_store['glyphs']) == ['g_2', 'h0', 'h1']
+
+    # Same glyph with an other id
+    assert not merge_glyphs({'h0': {'id': 'g_5', 'svg': ''}})
+    # Same id for an other glyph
+    assert not merge_glyphs({'h5': {'id': 'g_0', 'svg': ''}})
+
+
+class fake_document():
+    __version__ = 'test'
+    _global_store = {}
+    _optimize_svg = True
+
+
+def test_cache_lru_eviction(tmpdir):
+    from beampy.cache import cache_slides
+
+    cache = cache_slides(str(tmpdir), fake_document, max_entries=2)
+    for i, key in enumerate(['old', 'mid', 'new']):
+        digest = cache.store.put_blob('content %s' % key)
+        cache.store.set(key, {'blobs': {'svgout': digest}, 'atime': i, 'size': 10})
+
+    cache.write_cache()
+    assert 'old' not in cache.data
+    assert 'mid' in cache.data and 'new' in cache.data
+
+
+def test_file_digest_ignores_mtime(tmpdir):
+    from beampy.functions import file_digest
+
+    fname = str(tmpdir.join('figure.svg'))
+    with open(fname, 'w') as f:
+        f.write('<svg></svg>')
+
+    digest = file_digest(fname)
+    os.utime(fname, (0, 0))
+    assert file_digest(fname) == digest
+
+    with open(fname, 'w') as f:
+        f.write('<svg><g/></svg>')
+
+    assert file_digest(fname) != digest
+
+
+def test_cache_deps(tmpdir):
+    from beampy.cache import cache_slides
+    from beampy.document import document
+
+    class fake_module():
+        name = 'text'
+        cache_deps = ['theme', 'resize_raster']
+
+    module = fake_module()
+    document._resize_raster = True
+    deps = cache_slides(str(tmpdir), fake_document).get_deps(module)
+    assert deps['version'] == 'test'
+
+    # Only modules that depend on resize_raster see the change
+    document._resize_raster = False
+    assert cache_slides(str(tmpdir), fake_document).get_deps(module) != deps
+    module.cache_deps = ['theme']
+    deps = cache_slides(str(tmpdir), fake_document).get_deps(module)
+    document._resize_raster = True
+    assert cache_slides(str(tmpdir), fake_document).get_deps(module) == deps
+
+
+def test_text_render_cache(tmpdir):
+    from beampy.cache import cache_slides
+    from beampy.document import document
+
+    document._global_store['glyphs'] = {'g0': {'id': 'g_0', 'svg': "<path d='M0' id='g_0'/>"}}
+    cache = cache_slides(str(tmpdir), fake_document)
+    render = {'svg': '<svg><use xlink:href="#g_0"/></svg>', 'viewbox': '0 0 10 10'}
+    cache.add_text_render('key', render, 0.5)
+    cache.write_cache()
+
+    # Glyphs used by the render are restored with it
+    document._global_store['glyphs'] = {}
+    cache = cache_slides(str(tmpdir), fake_document)
+    assert cache.get_text_render('key') == render
+    assert 'g0' in document._global_store['glyphs']
+    assert cache.get_text_render('other') is None
+    assert cache.stats['latex']['hits'] == 1
+    assert cache.stats['latex']['misses'] == 1
+
+
+def test_pdf_cache(tmpdir):
+    from beampy.cache import cache_slides
+
+    cache = cache_slides(str(tmpdir), fake_document)
+    cache.add_pdf('svgdigest', b'%PDF-1.4', 0.2)
+    cache.write_cache()
+
+    cache = cache_slides(str(tmpdir), fake_document)
+    assert cache.get_pdf('svgdigest') == b'%PDF-1.4'
+    assert cache.get_pdf('otherdigest') is None
+    assert cache.stats['pdf']['hits'] == 1
+    assert cache.stats['pdf']['misses'] == 1
+
+
+def test_optimized_svg_cache(tmpdir):
+    from beampy.cache import cache_slides
+
+    cache = cache_slides(str(tmpdir), fake_document)
+    cache.add_optimized_svg('key', u'<svg/>', 1.5)
+    cache.write_cache()
+
+    cache = cache_slides(str(tmpdir), fake_document)
+    assert cache.get_optimized_svg('key') == u'<svg/>'
+    assert cache.get_optimized_svg('other') is None
+    assert cache.stats['scour'] == {'hits': 1, 'misses': 1, 'time_saved': 1.5}
+
+
+def test_glyph_id_is_given_by_content():
+    from beampy.functions import glyph_id
+
+    assert glyph_id('M0 0L1 1') == glyph_id('M0 0L1 1')
+    assert glyph_id('M0 0L1 1') != glyph_id('M0 0L1 2')
+    assert glyph_id('M0 0L1 1').startswith('g_')
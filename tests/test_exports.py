@@ -29,3 +29,131 @@ def test_html(make_one_slide):
 def test_pdf(make_one_slide):
     doc = make_one_slide
     save('./html_out/%s.pdf' % test_name)
+
+
+def test_glyphs_svg_defs(make_one_slide):
+    from beampy.document import document
+    from beampy.exports import glyphs_svg_defs
+
+    document._global_store['glyphs'] = {'h0': {'id': 'g_0', 'svg': "<path d='M0' id='g_0'/>"},
+                                        'h1': {'id': 'g_1', 'svg': "<path d='M1' id='g_1'/>"}}
+
+    # Only used glyphs are exported
+    assert glyphs_svg_defs('<use xlink:href="#g_1"/>') == "<defs><path d='M1' id='g_1'/></defs>"
+    assert glyphs_svg_defs('<rect/>') == '<defs></defs>'
+
+
+def test_incremental(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+
+    outputs = []
+    for i in range(2):
+        doc = document(source_filename=__name__)
+        with slide():
+            rectangle(width=50, height=50)
+
+        save('out.html', incremental=True)
+        outputs += [tmpdir.join('out.html').read()]
+
+    # The second build restore the slide from the cache
+    assert doc._cache.stats['slide'] == {'hits': 1, 'misses': 0, 'time_saved': 0}
+    assert outputs[0] == outputs[1]
+
+
+def test_incremental_group_layout(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+
+    outputs = []
+    for x in (10, 200):
+        doc = document(source_filename=__name__)
+        with slide():
+            with group(x=x, y=10, width=100, height=100):
+                rectangle(width=50, height=50)
+
+        save('out.html', incremental=True)
+        outputs += [tmpdir.join('out.html').read()]
+
+    # Moving the group changes the slide
+    assert doc._cache.stats['slide']['hits'] == 0
+    assert outputs[0] != outputs[1]
+
+
+def test_incremental_jobs(tmpdir, monkeypatch, capfd):
+    monkeypatch.chdir(tmpdir)
+
+    outputs = []
+    for i in range(2):
+        doc = document(source_filename=__name__)
+        for size in (50, 20):
+            with slide():
+                rectangle(width=size, height=size)
+
+        capfd.readouterr()
+        save('out.html', jobs=2, incremental=True)
+        outputs += [tmpdir.join('out.html').read()]
+
+    # Restored slides are not rendered again by the processes
+    assert 'Render slides with' not in capfd.readouterr().out
+    assert outputs[0] == outputs[1]
+
+
+def test_pdf_manifest(tmpdir):
+    from beampy.exports import read_pdf_manifest, write_pdf_manifest
+
+    manifest_file = str(tmpdir.join('pdf_manifest.json'))
+    manifest = read_pdf_manifest(manifest_file)
+    assert manifest['pdfs'] == {}
+
+    manifest['pdfs']['slide_0-0.pdf'] = 'digest'
+    write_pdf_manifest(manifest_file, manifest)
+    assert read_pdf_manifest(manifest_file)['pdfs'] == {'slide_0-0.pdf': 'digest'}
+
+    # Pdfs converted by an other inkscape are not reused
+    manifest['inkscape'] = 'Inkscape 0.1'
+    write_pdf_manifest(manifest_file, manifest)
+    assert read_pdf_manifest(manifest_file)['pdfs'] == {}
+
+
+def test_pdf_shared_layers(tmpdir):
+    from beampy.exports import save_layout, svg_export
+
+    doc = document(cache=False, source_filename=__name__, pdf_shared_layers=True,
+                   format='pdf')
+    with slide() as s:
+        rectangle(width=50, height=50)[:]
+        rectangle(width=20, height=20)[1]
+
+    save_layout()
+    s.newrender()
+
+    # The first rectangle is drawn in both layers, only once in pdf
+    assert s.svgshared is not None
+    assert sorted(s.svgoverlays) == [0, 1]
+    assert s.svgshared.count('<use') == 1
+    assert s.svgoverlays[0].count('<use') == 0
+    assert s.svgoverlays[1].count('<use') == 1
+
+    digests = {}
+    svg_export(str(tmpdir), shared_layers=True, digests=digests)
+    assert tmpdir.join('slide_0-shared.svg').check()
+
+    # Digests of the written svg files (used by pdf_export)
+    import hashlib
+    assert sorted(digests) == ['slide_0-0', 'slide_0-1', 'slide_0-shared']
+    assert digests['slide_0-1'] == hashlib.md5(tmpdir.join('slide_0-1.svg').read_binary()).hexdigest()
+
+
+def test_render_slides_error(tmpdir, monkeypatch):
+    import sys
+    monkeypatch.chdir(tmpdir)
+
+    doc = document(cache=False, source_filename=__name__)
+    with slide():
+        rect = rectangle(width=50, height=50)
+    with slide():
+        rectangle(width=50, height=50)
+
+    # Errors of modules stop the rendering processes with sys.exit
+    monkeypatch.setattr(type(rect), 'render', lambda self: sys.exit(1))
+    with pytest.raises(SystemExit):
+        save('out.html', jobs=2)
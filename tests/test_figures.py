@@ -53,3 +53,143 @@ def test_html(make_presentation):
 def test_pdf(make_presentation):
     doc = make_presentation
     save('./pdf_out/%s.pdf'%test_name)
+
+
+def test_mpl_figure_canvas():
+    from matplotlib.figure import Figure
+    from matplotlib.backend_bases import FigureCanvasBase
+
+    doc = document(cache=False)
+    fig = Figure()
+    fig.add_subplot(111).plot([0, 1], [0, 1])
+    canvas = FigureCanvasBase(fig)
+
+    with slide():
+        hashed = figure(fig)
+
+    # The canvas of the user figure is kept
+    assert fig.canvas is canvas
+    assert hashed.mpl_fig_hash
+
+
+def test_remap_svg_ids():
+    from beampy.functions import remap_svg_ids
+
+    svg = ('<defs><clipPath id="c1"/><path id="p1"/></defs>'
+           '<g clip-path="url(#c1)" data-id="c1"><use xlink:href="#p1"/><use href="#other"/></g>')
+
+    assert remap_svg_ids(svg, 'bp_') == ('<defs><clipPath id="bp_c1"/><path id="bp_p1"/></defs>'
+                                         '<g clip-path="url(#bp_c1)" data-id="c1"><use xlink:href="#bp_p1"/>'
+                                         '<use href="#other"/></g>')
+
+
+def test_split_svg_root():
+    from beampy.functions import split_svg_root
+
+    svg = ('<?xml version="1.0"?><svg width="10pt" height=\'20pt\' viewBox="0 0 10 20">'
+           '<g><svg width="1"/></g></svg>')
+
+    attrs, content = split_svg_root(svg)
+    assert attrs == {'width': '10pt', 'height': '20pt', 'viewBox': '0 0 10 20'}
+    assert content == '<g><svg width="1"/></g>'
+    assert split_svg_root('<!DOCTYPE svg [<!ENTITY a "b">]><svg>&a;</svg>') is None
+
+
+def test_svg_size_needs_inkscape(tmpdir):
+    from beampy.modules.figure import svg_size_needs_inkscape
+
+    svg_file = tmpdir.join('figure.svg')
+    svg_file.write('<svg width="10" height="10"><g/></svg>')
+    assert not svg_size_needs_inkscape(str(svg_file))
+    assert svg_size_needs_inkscape('<svg viewBox="0 0 10 10"><g/></svg>')
+
+
+def test_rasterize_heavy_artists():
+    import matplotlib
+    matplotlib.use('agg')
+    import pylab as p
+    from beampy.modules.figure import rasterize_heavy_artists
+
+    fig = p.figure()
+    scatter = p.scatter(p.rand(5000), p.rand(5000))
+    markers, = p.plot(p.rand(2000), 'o')
+    # A line without markers is a single svg path
+    line, = p.plot(p.rand(10000))
+    p.close(fig)
+
+    assert rasterize_heavy_artists(fig, None) == []
+    assert rasterize_heavy_artists(fig, 3000) == [scatter]
+    assert scatter.get_rasterized() and not line.get_rasterized()
+    assert not markers.get_rasterized()
+
+
+def test_rasterized_image_resolution():
+    import re
+    import base64
+    import matplotlib
+    matplotlib.use('agg')
+    import pylab as p
+    from io import BytesIO
+    from PIL import Image
+
+    doc = document(cache=False, resize_raster=True)
+    fig = p.figure()
+    p.scatter(p.rand(5000), p.rand(5000))
+    p.close(fig)
+
+    with slide():
+        fig_module = figure(fig, width=600, rasterize_threshold=1000)
+
+    fig_module.render()
+    png = re.search(r'base64, ?([^"\']+)', fig_module.svgout).group(1)
+    img = Image.open(BytesIO(base64.b64decode(png)))
+
+    # The axes are rasterized at twice the resolution of the slide, they
+    # are not resized back to the figure width
+    assert img.size[0] > 600
+
+
+def test_scour_fast_path():
+    pytest.importorskip('numpy')
+    from beampy.scour import scour
+
+    options = scour.generateDefaultOptions()
+    options.fast_path_threshold = 4
+    svg = ('<svg xmlns="http://www.w3.org/2000/svg">'
+           '<path d="M 0.5,-0.25 L 1234567,0.000012 L 10 20 z"/></svg>')
+
+    assert '<path d="M0.5-0.25L1.2346e6 1.2e-5 10 20z"/>' in scour.scourString(svg, options)
+
+
+def test_scour_float_precision():
+    from beampy.scour import scour
+
+    svg = ('<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 123.456789 1000">'
+           '<path d="M 0.5,-0.25 L 123456.7,0.000012 C 1 2 3 4 10000 6 z" stroke-width="1.23456789"/></svg>')
+
+    options = scour.generateDefaultOptions()
+    decimal_svg = scour.scourString(svg, options)
+    options.float_precision = True
+    assert scour.scourString(svg, options) == decimal_svg
+
+
+def test_scour_float_precision_matplotlib():
+    import matplotlib
+    matplotlib.use('agg')
+    import pylab as p
+    from io import BytesIO
+    from beampy.scour import scour
+
+    fig = p.figure()
+    p.plot([0, 1, 2, 3], [0, 1, 0, 2])
+    p.bar([0, 1], [1, 2])
+    with BytesIO() as f:
+        fig.savefig(f, format='svg')
+        svg = f.getvalue().decode('utf-8')
+    p.close(fig)
+
+    # Float differences are rounded like the Decimal arithmetic
+    options = scour.generateDefaultOptions()
+    decimal_svg = scour.scourString(svg, options)
+    options.float_precision = True
+    assert scour.scourString(svg, options) == decimal_svg
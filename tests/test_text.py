@@ -65,3 +65,18 @@ def test_pdf(make_presentation):
     doc = make_presentation
     save('./pdf_out/%s.pdf'%test_name)
 
+
+
+def test_latex_format_fallback(monkeypatch):
+    import io
+    from beampy import functions
+
+    cmds = []
+    def fake_popen(cmd):
+        cmds.append(cmd)
+        # The run with the format fails
+        return io.StringIO(u'! Fatal format file error' if '-fmt=' in cmd else u'Output written')
+
+    monkeypatch.setattr(functions.os, 'popen', fake_popen)
+    assert functions.run_latex('f.tex', 'TEXFORMATS=/fmt: latex -fmt=beampyfmt') == 'Output written'
+    assert len(cmds) == 2 and ' latex -interaction' in cmds[1]
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Test the watch mode of beampy
+"""
+import os
+import sys
+import threading
+from beampy.document import document
+from beampy.watch import script_builder, watch_server, make_handler
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    # Python 2
+    from urllib2 import urlopen
+
+
+SCRIPT = """
+from beampy import *
+doc = document(cache=False)
+with slide():
+    figure('figure.svg', width=100)
+save('out.html')
+"""
+
+
+def make_builder(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    # The builder changes the document and the arguments of the script
+    monkeypatch.setattr(document, '_keep_cache', False)
+    monkeypatch.setattr(sys.modules['beampy.document'], 'script_file_name',
+                        sys.modules['beampy.document'].script_file_name)
+    monkeypatch.setattr(sys, 'argv', list(sys.argv))
+
+    tmpdir.join('figure.svg').write('<svg width="10" height="10"><rect width="5" height="5"/></svg>')
+    tmpdir.join('presentation.py').write(SCRIPT)
+
+    return script_builder(str(tmpdir.join('presentation.py')))
+
+
+def test_watched_files(tmpdir, monkeypatch):
+    builder = make_builder(tmpdir, monkeypatch)
+    builder.run()
+
+    assert builder.build_count == 1
+    assert builder.output == str(tmpdir.join('out.html'))
+    assert builder.watched_files() == set([builder.script, str(tmpdir.join('figure.svg'))])
+    assert not builder.changed()
+
+    os.utime(str(tmpdir.join('figure.svg')), (0, 0))
+    assert builder.changed()
+
+
+def test_reload_events(tmpdir, monkeypatch):
+    builder = make_builder(tmpdir, monkeypatch)
+
+    server = watch_server(('localhost', 0), make_handler(builder))
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    try:
+        events = urlopen('http://localhost:%i/__beampy_events' % server.server_address[1],
+                         timeout=10)
+        builder.run()
+        assert events.readline() == b'data: reload\n'
+        events.close()
+    finally:
+        server.shutdown()
+        server.server_close()